@@ -1,6 +1,7 @@
 # single-file web app: Challan + Invoice (Flask) with Google Sheets + PDF
 # - Deployable on Railway (or any host)
 # - Secrets via ENV: SPREADSHEET_ID, GOOGLE_SA_JSON, SESSION_SECRET
+# - Session is a signed cookie (Secure, SameSite=Strict); SESSION_COOKIE_SECURE=0 for plain-http hosts
 # - Optional ENV: SAVE_DIR (server copy; default on Windows -> C:\Invoice_Challan)
 # - Login reads ID/PASS from Google Sheet tab "PASS" (A2=id, B2=pass)
 # - Challan: 2 copies per page, 5 rows, logs to "Challan"
@@ -15,14 +16,18 @@
 #
 # pip install: flask gspread google-auth reportlab gunicorn requests
 
-import os, re, io, json, base64
+import os, re, io, json, base64, threading, time, hashlib, secrets, logging, tempfile, gzip
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from functools import wraps
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from itertools import repeat
+from pathlib import Path
 
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, send_file, flash
+    session, send_file, flash, jsonify
 )
 
 from reportlab.lib.pagesizes import A4
@@ -30,20 +35,32 @@ from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 from reportlab.pdfbase import pdfmetrics
 from reportlab.lib.utils import ImageReader
+from PIL import Image as PILImage   # ships with reportlab
 
-import gspread
-from google.oauth2.service_account import Credentials as SA_Credentials
 from jinja2 import DictLoader
+from jinja2.utils import htmlsafe_json_dumps
 
 import requests  # for remote logo URLs
 
 # ==============================
 # Config from ENV
 # ==============================
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger(__name__)
+
 SPREADSHEET_ID   = os.getenv("SPREADSHEET_ID")        # required
 GOOGLE_SA_JSON   = os.getenv("GOOGLE_SA_JSON")        # service account JSON (single env var)
 SESSION_SECRET   = os.getenv("SESSION_SECRET", "change-me")
 
+# Service-account info parsed once; _gc() builds creds from it on first use
+try:
+    _SA_INFO = json.loads(GOOGLE_SA_JSON) if GOOGLE_SA_JSON else None
+except Exception as e:
+    log.error("GOOGLE_SA_JSON is not valid JSON: %s", e);  _SA_INFO = None
+if not _SA_INFO or not SPREADSHEET_ID:
+    log.error("Missing env vars: GOOGLE_SA_JSON and/or SPREADSHEET_ID; Sheets features disabled.")
+
 # Optional: where to save a server-side copy (works if path exists & writable)
 SAVE_DIR = os.getenv("SAVE_DIR", "").strip()
 if not SAVE_DIR and os.name == "nt":
@@ -61,6 +78,11 @@ GST_TOTAL   = float(os.getenv("GST_TOTAL", "5.0"))
 CGST_RATE   = SGST_RATE = GST_TOTAL/2.0
 SAC_DEFAULT = os.getenv("SAC_DEFAULT", "123456")
 
+# In-process cache lifetime (seconds) for sheet loaders
+SHEET_CACHE_TTL   = int(os.getenv("SHEET_CACHE_TTL", "300"))    # firms / suppliers
+CHALLAN_CACHE_TTL = int(os.getenv("CHALLAN_CACHE_TTL", "30"))   # challan rows (written by the app)
+NEXT_NO_CACHE_TTL = int(os.getenv("NEXT_NO_CACHE_TTL", "30"))   # suggested next challan/invoice no.
+
 INV_MAX_ROWS = 10
 CH_MAX_ROWS  = 5
 
@@ -106,6 +128,12 @@ LOGO_DIR = os.getenv("LOGO_DIR", os.path.join("invoice2", "billing-app", "static
 app = Flask(__name__)
 app.secret_key = SESSION_SECRET
 app.permanent_session_lifetime = timedelta(days=30)  # "remember me"
+# Flask's signed-cookie session (no server-side store): login_required is a local signature check
+app.config.update(
+  SESSION_COOKIE_HTTPONLY=True,
+  SESSION_COOKIE_SAMESITE="Strict",
+  SESSION_COOKIE_SECURE=bool(int(os.getenv("SESSION_COOKIE_SECURE", "1"))),  # 0 only for plain-http hosts
+)
 
 # Normalize a usable local logos base (fallback)
 def _candidate_logo_dirs():
@@ -128,124 +156,248 @@ LOGO_BASE_DIR = next((p for p in _candidate_logo_dirs() if os.path.isdir(p)), No
 # ==============================
 # Small helpers
 # ==============================
+_SLUG_RE  = re.compile(r'[^a-z0-9]+')
+_SPACE_RE = re.compile(r'\s+')
+_UNSAFE_NAME_RE = re.compile(r'[^A-Za-z0-9_]+')   # download file names
+
 def _slug_lower(name):
-    return re.sub(r'[^a-z0-9]+', '_', (name or '').lower()).strip('_')
+    return _SLUG_RE.sub('_', (name or '').lower()).strip('_')
 
 def _firm_dir_name(name):
-    return re.sub(r'\s+', '_', (name or '').strip())
+    return _SPACE_RE.sub('_', (name or '').strip())
 
-def _local_logo_path(company_name):
-    if not LOGO_BASE_DIR:
-        return None
-    slug = _slug_lower(company_name)
+def _scan_logo_dir(base):
+    """{file stem: path} for logo images in base; first extension in preference order wins."""
+    try: names = set(os.listdir(base)) if base else set()
+    except OSError: return {}
+    out = {}
     for ext in (".jpeg", ".jpg", ".png", ".webp"):
-        p = os.path.join(LOGO_BASE_DIR, slug + ext)
-        if os.path.exists(p):
-            return p
-    return None
+        for fn in names:
+            if fn.endswith(ext): out.setdefault(fn[:-len(ext)], os.path.join(base, fn))
+    return out
+
+_LOGO_INDEX = _scan_logo_dir(LOGO_BASE_DIR)   # scanned once; logos ship with the deploy
+
+def _local_logo_path(company_name):
+    return _LOGO_INDEX.get(_slug_lower(company_name))
 
 # HTTP session for remote logos
 HTTP = requests.Session()
 HTTP.headers.update({
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome Safari"
 })
+for _scheme in ("http://", "https://"):
+    HTTP.mount(_scheme, requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+_GDRIVE_ID_RE = re.compile(r"/file/d/([^/]+)/")
+_IMGUR_ID_RE  = re.compile(r"imgur\.com/([^./?]+)$")
+_OG_IMAGE_RE  = re.compile(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', re.I)
+_IMG_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".gif")   # direct image links (vs share pages)
 
+@lru_cache(maxsize=512)
 def _normalize_remote_url(u):
     u = u.strip()
     if u.startswith("https://drive.google.com/file/d/"):
-        m = re.search(r"/file/d/([^/]+)/", u)
+        m = _GDRIVE_ID_RE.search(u)
         if m: return f"https://drive.google.com/uc?export=download&id={m.group(1)}"
     if "dropbox.com" in u and "raw=1" not in u and "dl=1" not in u:
         sep = "&" if "?" in u else "?"
         u = u + sep + "raw=1"
     if "imgur.com" in u and "i.imgur.com" not in u:
-        m = re.search(r"imgur\.com/([^./?]+)$", u)
+        m = _IMGUR_ID_RE.search(u)
         if m: return f"https://i.imgur.com/{m.group(1)}.jpg"
         u = u.replace("://imgur.com/", "://i.imgur.com/")
     return u
 
+_OG_CACHE = {}   # page url -> (expires_at, og:image url or None)
+
 def _resolve_og_image(page_url):
+    hit = _OG_CACHE.get(page_url)
+    if hit and hit[0] > time.monotonic(): return hit[1]
     try:
         r = HTTP.get(page_url, timeout=8)
         r.raise_for_status()
-        m = re.search(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', r.text, re.I)
-        return m.group(1) if m else None
+        m = _OG_IMAGE_RE.search(r.text)
+        og = m.group(1) if m else None
     except Exception:
-        return None
+        og = None
+    # share pages rarely change their og:image; a failed lookup is retried like a failed logo
+    _OG_CACHE[page_url] = (time.monotonic() + (LOGO_REVALIDATE_SECS if og else LOGO_RETRY_SECS), og)
+    return og
 
 # ==============================
 # Google Sheets helpers
 # ==============================
+# Authorized client, spreadsheet and worksheet handles are built once per process
+_GS_LOCK   = threading.RLock()
+_GC_CLIENT = None
+_SH_HANDLE = None
+_WS_CACHE  = {}
+_gspread   = None
+
+def _get_gspread():
+    # gspread + google-auth cost ~150 ms to import; only pay it once Sheets are actually needed
+    global _gspread
+    if _gspread is None:
+        import gspread
+        _gspread = gspread
+    return _gspread
+
 def _gc():
-    if not GOOGLE_SA_JSON or not SPREADSHEET_ID:
-        raise RuntimeError("Missing env vars: GOOGLE_SA_JSON and/or SPREADSHEET_ID.")
-    info = json.loads(GOOGLE_SA_JSON)
-    creds = SA_Credentials.from_service_account_info(info, scopes=SHEETS_SCOPES)
-    return gspread.authorize(creds)
+    global _GC_CLIENT
+    if _GC_CLIENT is None:
+        with _GS_LOCK:
+            if _GC_CLIENT is None:
+                if not _SA_INFO or not SPREADSHEET_ID:
+                    raise RuntimeError("Missing env vars: GOOGLE_SA_JSON and/or SPREADSHEET_ID.")
+                from google.oauth2.service_account import Credentials as SA_Credentials
+                creds = SA_Credentials.from_service_account_info(_SA_INFO, scopes=SHEETS_SCOPES)
+                _GC_CLIENT = _get_gspread().authorize(creds)   # its session refreshes the token on demand
+    return _GC_CLIENT
+
+def _sh():
+    global _SH_HANDLE
+    if _SH_HANDLE is None:
+        with _GS_LOCK:
+            if _SH_HANDLE is None:
+                _SH_HANDLE = _gc().open_by_key(SPREADSHEET_ID)
+    return _SH_HANDLE
 
 def _ws(sheet_name):
-    gc = _gc()
-    return gc.open_by_key(SPREADSHEET_ID).worksheet(sheet_name)
+    ws = _WS_CACHE.get(sheet_name)
+    if ws is None:
+        with _GS_LOCK:
+            ws = _WS_CACHE.get(sheet_name)
+            if ws is None:
+                # one metadata fetch opens every tab (worksheet(name) refetches it per tab);
+                # duplicate titles resolve to the first, like worksheet() does
+                for w in _sh().worksheets():
+                    _WS_CACHE.setdefault(w.title, w)
+                ws = _WS_CACHE.get(sheet_name)
+                if ws is None: raise _get_gspread().exceptions.WorksheetNotFound(sheet_name)
+    return ws
+
+def _reset_clients():
+    """Drop cached client/handles (stale creds, renamed tabs)."""
+    global _GC_CLIENT, _SH_HANDLE
+    with _GS_LOCK:
+        _GC_CLIENT = None; _SH_HANDLE = None
+        _WS_CACHE.clear(); _NUM_COLS.clear()
+
+# ---------- Small TTL cache for sheet loaders ----------
+_CACHE_LOCK = threading.Lock()
+_CACHE = {}   # key -> (expires_at, value)
+
+_CACHE_TTLS = {}  # key -> ttl, registered by @_ttl_cached
+_FILL_LOCKS = {}  # key -> lock held while one thread reloads that key
+
+def _cache_fresh(key):
+    hit = _CACHE.get(key)
+    return hit is not None and hit[0] > time.monotonic()
+
+def _cache_put(key, val):
+    if val:  # loaders return empty on Sheets errors; don't pin that
+        with _CACHE_LOCK:
+            _CACHE[key] = (time.monotonic() + _CACHE_TTLS[key], val)
+    return val
+
+def _ttl_cached(key, ttl):
+    _CACHE_TTLS[key] = ttl; fill_lock = _FILL_LOCKS.setdefault(key, threading.Lock())
+    def deco(fn):
+        @wraps(fn)
+        def wrapper():
+            hit = _CACHE.get(key)
+            if hit and hit[0] > time.monotonic():
+                return hit[1]
+            with fill_lock:  # one Sheets fetch per expiry; concurrent misses wait and reuse it
+                hit = _CACHE.get(key)
+                if hit and hit[0] > time.monotonic():
+                    return hit[1]
+                return _cache_put(key, fn())
+        return wrapper
+    return deco
+
+def invalidate_caches(*keys):
+    """Drop cached loader results (all when no keys given)."""
+    with _CACHE_LOCK:
+        if not keys: _CACHE.clear()
+        for k in keys: _CACHE.pop(k, None)
+
+_FIRM_COLS = ("firm", "address", "number", "gst", "logolink",
+              "bank", "account_name", "account_number", "ifsc", "branch")
+
+def _parse_firms(rows):
+    """ID tab values -> dict: key -> profile dict."""
+    if not rows: return {}
+    header = [h.strip().lower() for h in rows[0]]
+    idx = {h:i for i,h in enumerate(header)}
+    cols = [idx.get(k) for k in _FIRM_COLS]   # resolved once, not per cell
+    width = len(header)
+    out = {}
+    for r in rows[1:]:
+        if not r or not any(r): continue
+        if len(r) < width: r = r + [""] * (width - len(r))
+        firm, addr, mobile, gst, sheet_logo, bank, ac_name, ac_no, ifsc, branch = (
+            r[i].strip() if i is not None else "" for i in cols)
+        if not firm: continue
+        firm_uc = firm.upper()
+        out[firm_uc] = {
+            "title_name": firm_uc,
+            "company_name": firm,
+            "addr": addr,
+            "mobile": mobile,
+            "gst": gst,
+            "logo": (sheet_logo or LOGO_OVERRIDES.get(firm_uc) or _local_logo_path(firm)),
+            "bank_lines": [
+                f"Bank: {bank or '—'}",
+                f"A/C Name: {ac_name or '—'}",
+                f"A/C No.: {ac_no or '—'}",
+                f"IFSC: {ifsc or '—'}",
+                f"Branch: {branch or '—'}",
+            ],
+        }
+    _prefetch_logos(p["logo"] for p in out.values())
+    return out
 
+def _parse_suppliers(rows):
+    """Supplier tab values -> dict: code -> supplier dict (numericised like get_all_records)."""
+    if not rows: return {}
+    gu = _get_gspread().utils
+    records = gu.to_records(rows[0], [gu.numericise_all(r) for r in rows[1:]])
+    out = {}
+    for r in records:
+        code = str(r.get("Supplier Code","")).strip()
+        if not code: continue
+        out[code] = {
+            "name":    str(r.get("Supplier Name","")).strip(),
+            "gstin":   str(r.get("Supplier GSTIN","")).strip(),
+            "mobile":  str(r.get("Supplier Mobile","")).strip(),
+            "address": str(r.get("Supplier Address","")).strip(),
+        }
+    return out
+
+@_ttl_cached("firms", SHEET_CACHE_TTL)
 def load_firms():
     """Return dict: key -> profile dict."""
     try:
-        ws = _ws(ID_TAB_NAME)
-        rows = ws.get_all_values()
-        if not rows: return {}
-        header = [h.strip().lower() for h in rows[0]]
-        idx = {h:i for i,h in enumerate(header)}
-        def val(r, name):
-            i = idx.get(name.lower());  return (r[i].strip() if i is not None and i < len(r) else "")
-        out = {}
-        for r in rows[1:]:
-            if not r or not any(r): continue
-            firm = val(r, "firm")
-            if not firm: continue
-            firm_uc = firm.upper()
-            sheet_logo = val(r, "logolink")
-            out[firm_uc] = {
-                "title_name": firm_uc,
-                "company_name": firm,
-                "addr": val(r,"address"),
-                "mobile": val(r,"number"),
-                "gst": val(r,"gst"),
-                "logo": (sheet_logo or LOGO_OVERRIDES.get(firm_uc) or _local_logo_path(firm)),
-                "bank_lines": [
-                    f"Bank: {val(r,'bank') or '—'}",
-                    f"A/C Name: {val(r,'account_name') or '—'}",
-                    f"A/C No.: {val(r,'account_number') or '—'}",
-                    f"IFSC: {val(r,'ifsc') or '—'}",
-                    f"Branch: {val(r,'branch') or '—'}",
-                ],
-            }
-        return out
+        return _parse_firms(_ws(ID_TAB_NAME).get_all_values())
     except Exception as e:
-        print("Firms load error:", e);  return {}
+        log.warning("Firms load error: %s", e, exc_info=True);  return {}
 
+@_ttl_cached("suppliers", SHEET_CACHE_TTL)
 def load_suppliers():
     try:
-        ws = _ws(SUPPLIER_TAB_NAME)
-        rows = ws.get_all_records()
-        out = {}
-        for r in rows:
-            code = str(r.get("Supplier Code","")).strip()
-            if not code: continue
-            out[code] = {
-                "name":    str(r.get("Supplier Name","")).strip(),
-                "gstin":   str(r.get("Supplier GSTIN","")).strip(),
-                "mobile":  str(r.get("Supplier Mobile","")).strip(),
-                "address": str(r.get("Supplier Address","")).strip(),
-            }
-        return out
+        return _parse_suppliers(_ws(SUPPLIER_TAB_NAME).get_all_values())
     except Exception as e:
-        print("Suppliers load error:", e);  return {}
+        log.warning("Suppliers load error: %s", e, exc_info=True);  return {}
 
 # ---------- Canonical header for Challan rows (Invoice import UI) ----------
 CANON_KEYS = [
     "Firm","Supplier Code","Challan_Number","INVOICE_MTR","Description","Qty","MTR","Rate","Amount","Taxable_Amount"
 ]
-def _norm_key(s): return re.sub(r"[^a-z0-9]+","", (s or "").lower())
+OPEN_ROW_KEYS = ("Description", "Qty", "MTR", "Rate", "Amount", "Taxable_Amount")   # read by addFromChallan
+_NORM_RE = re.compile(r"[^a-z0-9]+")
+def _norm_key(s): return _NORM_RE.sub("", (s or "").lower())
 
 KEY_SYNONYMS = {
     "Firm": ["firm","company","companyname"],
@@ -260,74 +412,159 @@ KEY_SYNONYMS = {
     "Taxable_Amount": ["taxable_amount","taxableamount","line_total","linetotal","totalamount"]
 }
 
+# normalized synonym -> canonical key (first canonical key listed wins, e.g. "qty" -> Qty)
+_SYN_LOOKUP = {}
+for _canon, _alts in KEY_SYNONYMS.items():
+    for _syn in (_canon, *_alts):
+        _SYN_LOOKUP.setdefault(_norm_key(_syn), _canon)
+
+# Challan rows as columns (struct-of-arrays): one list per canonical key, plus
+# index: (FIRM, supplier code, challan no) -> row positions
+class ChallanData(namedtuple("ChallanData", [k.replace(" ", "_") for k in CANON_KEYS] + ["index"])):
+    __slots__ = ()
+    def __bool__(self): return bool(self.Firm)
+    def open_rows(self, firm, scode):
+        """{challan no: [row dicts]} for one firm+supplier, only rows with blank INVOICE_MTR.
+
+        Rows carry just the OPEN_ROW_KEYS the Invoice form reads; firm, supplier and
+        challan no. are implied by the request and the group key.
+        """
+        firm, scode, mtr = firm.strip().upper(), scode.strip(), self.INVOICE_MTR
+        cols, out = {k: getattr(self, k) for k in OPEN_ROW_KEYS}, {}
+        for (f, s, ch), ps in self.index.items():
+            if f != firm or s != scode or not ch: continue
+            rows = [{k: col[p] for k, col in cols.items()} for p in ps if not str(mtr[p]).strip()]
+            if rows: out[ch] = rows
+        return out
+
+def _empty_challans():
+    return ChallanData(*([] for _ in CANON_KEYS), index={})
+
+def _parse_challans(values):
+    """Challan tab values -> ChallanData with canonical columns so the Invoice UI always sees them."""
+    if not values: return _empty_challans()
+    raw_header = values[0]
+    canon_to_col = {}
+    for i, h in enumerate(raw_header):   # later duplicate headers win, as before
+        k = _norm_key(h)
+        if k in _SYN_LOOKUP: canon_to_col[_SYN_LOOKUP[k]] = i
+    rows = [r for r in values[1:] if any(r)]
+    width = max(canon_to_col.values(), default=-1) + 1
+    rows = [r if len(r) >= width else r + [""] * (width - len(r)) for r in rows]
+    # column-wise fill: one comprehension per mapped column, unmapped ones are all ""
+    data = ChallanData(*([r[ci] for r in rows] if ci is not None else [""] * len(rows)
+                         for ci in (canon_to_col.get(ck) for ck in CANON_KEYS)), index={})
+    index = data.index
+    for n, key in enumerate(zip([f.strip().upper() for f in data.Firm],
+                                [s.strip() for s in data.Supplier_Code],
+                                [c.strip() for c in data.Challan_Number])):
+        index.setdefault(key, []).append(n)
+    return data
+
+@_ttl_cached("challans", CHALLAN_CACHE_TTL)
 def load_challan_rows():
-    """Return list of rows with canonical keys so the Invoice UI always sees them."""
     try:
-        ws = _ws(CHALLAN_TAB_NAME)
-        values = ws.get_all_values()
-        if not values: return []
-        raw_header = values[0]
-        canon_map = {}
-        for h in raw_header:
-            keyn = _norm_key(h)
-            for canon, alts in KEY_SYNONYMS.items():
-                if keyn in { _norm_key(x) for x in ([canon] + alts) }:
-                    canon_map[h] = canon
-                    break
-        rows = []
-        for r in values[1:]:
-            if not any(r): continue
-            rec = {}
-            for i, cell in enumerate(r):
-                if i >= len(raw_header): break
-                h = raw_header[i]
-                canon = canon_map.get(h)
-                if canon:
-                    rec[canon] = cell
-            for ck in CANON_KEYS:
-                rec.setdefault(ck, "")
-            rows.append(rec)
-        return rows
+        return _parse_challans(_ws(CHALLAN_TAB_NAME).get_all_values())
     except Exception as e:
-        print("Challan load error:", e);  return []
+        log.warning("Challan load error: %s", e, exc_info=True);  return _empty_challans()
 
-def get_next_invoice_number():
-    try:
-        ws = _ws(INVOICE_TAB_NAME)
-        rows = ws.get_all_records()
-        max_num = 0
-        for r in rows:
-            raw = str(r.get("Invoice_Number","")).strip()
-            m = re.search(r"(\d+)$", raw)
-            num = int(raw) if raw.isdigit() else (int(m.group(1)) if m else None)
-            if isinstance(num, int) and num > max_num: max_num = num
-        return str(max_num + 1 if max_num > 0 else 1)
-    except Exception:
-        return "1"
+# ---------- One batchGet for several cold loaders ----------
+_BATCH_TABS = {   # cache key -> (tab, values parser)
+    "firms":     (ID_TAB_NAME, _parse_firms),
+    "suppliers": (SUPPLIER_TAB_NAME, _parse_suppliers),
+    "challans":  (CHALLAN_TAB_NAME, _parse_challans),
+}
 
-def get_next_challan_number():
+def _batch_load(*keys, extra=()):
+    """Fill the cold caches among keys from one values_batch_get; extra (tab, A1) ranges
+    ride along and their values are returned. Sheets errors propagate."""
+    cold = [k for k in keys if not _cache_fresh(k)]
+    if not cold and not extra: return []
+    arn = _get_gspread().utils.absolute_range_name
+    ranges = [arn(*e) for e in extra] + [arn(_BATCH_TABS[k][0]) for k in cold]
+    vr = _sh().values_batch_get(ranges).get("valueRanges", [])
+    vals = [r.get("values", []) for r in vr] + [[]] * (len(ranges) - len(vr))
+    for k, rows in zip(cold, vals[len(extra):]):
+        _cache_put(k, _BATCH_TABS[k][1](rows))
+    return vals[:len(extra)]
+
+def prefetch_sheets(*keys):
+    """Best-effort _batch_load; loaders still fetch on their own if this fails."""
+    try: _batch_load(*keys)
+    except Exception as e: log.warning("Sheets prefetch error: %s", e, exc_info=True)
+
+def warm_caches():
+    """Fill firms, suppliers and challans together (worker boot, /admin/refresh)."""
+    prefetch_sheets("firms", "suppliers", "challans")
+
+def _col_a1(i):
+    """0-based column index -> A1 column letters."""
+    return _get_gspread().utils.rowcol_to_a1(1, i + 1)[:-1]
+
+_TRAIL_DIGITS = re.compile(r"(\d+)$")
+_NUM_COLS     = {}   # (tab, header) -> column letter last seen; re-checked against row 1 on each read
+
+def _trailing_int(v):
+    if type(v) is int: return v   # UNFORMATTED_VALUE hands numeric cells over as ints
+    m = _TRAIL_DIGITS.search(str(v).strip())   # one pass; isdigit() also let "²" through to int()
+    return int(m.group(1)) if m else None
+
+def _next_number(sheet_name, colname):
+    """Max trailing integer in one column + 1 (reads only that column); None on error."""
     try:
-        ws = _ws(CHALLAN_TAB_NAME)
-        rows = ws.get_all_records()
-        max_num = 0
-        for r in rows:
-            raw = str(r.get("Challan_Number","")).strip()
-            m = re.search(r"(\d+)$", raw)
-            num = int(raw) if raw.isdigit() else (int(m.group(1)) if m else None)
-            if isinstance(num, int) and num > max_num: max_num = num
-        return str(max_num + 1 if max_num > 0 else 1)
-    except Exception:
-        return "1"
+        ws = _ws(sheet_name)
+        key = (sheet_name, colname)
+        col = _NUM_COLS.get(key)
+        # row 1 rides along with the column read, so a column the user moved is noticed at once
+        got = ws.batch_get(["1:1"] + ([f"{col}2:{col}"] if col else []), major_dimension="COLUMNS",
+                           value_render_option="UNFORMATTED_VALUE")
+        header = [str(c[0]).strip() if c else "" for c in got[0]]
+        if colname not in header: return "1"
+        want = _col_a1(header.index(colname))
+        if want != col:
+            _NUM_COLS[key] = col = want
+            got = [None] + ws.batch_get([f"{col}2:{col}"], major_dimension="COLUMNS",
+                                        value_render_option="UNFORMATTED_VALUE")
+        cols = got[1]
+        nums = map(_trailing_int, cols[0] if cols else ())
+        return str(max((n for n in nums if n is not None), default=0) + 1)
+    except Exception as e:
+        log.warning("Next number lookup failed (%s): %s", sheet_name, e);  return None
+
+# GETs reuse the last read; POSTs bump it locally instead of re-reading the column
+@_ttl_cached("next_invoice", NEXT_NO_CACHE_TTL)
+def _next_invoice_number(): return _next_number(INVOICE_TAB_NAME, "Invoice_Number")
+
+@_ttl_cached("next_challan", NEXT_NO_CACHE_TTL)
+def _next_challan_number(): return _next_number(CHALLAN_TAB_NAME, "Challan_Number")
+
+def get_next_invoice_number(): return _next_invoice_number() or "1"
+def get_next_challan_number(): return _next_challan_number() or "1"
+
+def _note_number_used(key, used):
+    """After a POST with number `used`, suggest used+1 unless a higher number is cached."""
+    num = _trailing_int(used)
+    if num is None: return
+    hit = _CACHE.get(key) if _cache_fresh(key) else None
+    cur = _trailing_int(hit[1]) if hit else None
+    if cur is None or num + 1 > cur: _cache_put(key, str(num + 1))
+
+def _sha(s): return hashlib.sha256((s or "").strip().encode()).digest()
+
+def _creds_match(username, password, uid, upwd):
+    # compare digests in constant time (no early exit on the first differing char)
+    ok_user = secrets.compare_digest(_sha(username), _sha(uid))
+    ok_pass = secrets.compare_digest(_sha(password), _sha(upwd))
+    return ok_user and ok_pass
 
 def check_login_from_sheet(username, password):
-    """PASS sheet: A2 = ID, B2 = PASS"""
+    """PASS sheet: A2 = ID, B2 = PASS. Cold firm/supplier caches are filled from the same batchGet."""
     try:
-        ws = _ws(PASS_TAB_NAME)
-        uid  = ws.acell("A2").value or ""
-        upwd = ws.acell("B2").value or ""
-        return (username.strip() == (uid or "").strip()) and (password.strip() == (upwd or "").strip())
+        vals = _batch_load("firms", "suppliers", extra=[(PASS_TAB_NAME, "A2:B2")])
+        uid, upwd = ((vals[0][0] if vals[0] else []) + ["", ""])[:2]
+        return _creds_match(username, password, uid, upwd)
     except Exception as e:
-        print("PASS sheet error:", e);  return False
+        log.warning("PASS sheet error: %s", e, exc_info=True);  return False
 
 # ---------- Ensure Challan header (name-based, no reordering) ----------
 REQ_CHALLAN_HEADER = [
@@ -335,85 +572,106 @@ REQ_CHALLAN_HEADER = [
     "Supplier Code","Supplier_Name","Gst_No","Description","Qty","Amount","Taxable_Amount",
     "INVOICE_MTR","Rate"
 ]
+_REQ_CHALLAN_LOWER = [(c, c.lower()) for c in REQ_CHALLAN_HEADER]
+
+def _header_index(header):
+    return {h.strip().lower(): i for i, h in enumerate(header)}
 
 def _ensure_challan_header(ws):
-    vals = ws.get_all_values()
-    header = vals[0] if vals else []
-    if not header:
-        ws.update("A1", [REQ_CHALLAN_HEADER])
-        header = REQ_CHALLAN_HEADER[:]
-    else:
-        existing_l = [h.strip().lower() for h in header]
-        changed = False
-        for col in REQ_CHALLAN_HEADER:
-            if col.lower() not in existing_l:
-                header.append(col); changed = True
-        if changed:
-            ws.update("A1", [header])
-    idx_lower = {h.strip().lower(): i for i, h in enumerate(header)}
+    """(header, idx_lower) of the Challan tab for appends, adding any REQ_CHALLAN_HEADER columns."""
+    header = ws.row_values(1)   # every append: users insert/move columns in this tab
+    write = not header
+    if write: header = REQ_CHALLAN_HEADER[:]
+    idx_lower = _header_index(header)
+    missing = [(col, low) for col, low in _REQ_CHALLAN_LOWER if low not in idx_lower]
+    for col, low in missing:
+        idx_lower[low] = len(header); header.append(col)
+    if write or missing:
+        ws.update("A1", [header])
     return header, idx_lower
 
-def append_row_to_invoice(row_values):
+# Sheet writes run on the request thread and return False (logged) on failure, so the route can
+# tell the user instead of handing out a PDF that was never recorded
+def append_rows_to_invoice(rows):
+    if not rows: return True
     try:
-        _ws(INVOICE_TAB_NAME).append_row(row_values, value_input_option="USER_ENTERED")
+        _ws(INVOICE_TAB_NAME).append_rows(rows, value_input_option="USER_ENTERED",
+                                          insert_data_option="INSERT_ROWS")
+        return True
     except Exception as e:
-        print("Append Invoice failed:", e)
+        log.warning("Append Invoice failed: %s", e, exc_info=True);  return False
 
-def append_row_to_challan(row_dict):
+def append_rows_to_challan(row_dicts):
+    if not row_dicts: return True
     try:
         ws = _ws(CHALLAN_TAB_NAME)
         header, idx_lower = _ensure_challan_header(ws)
-        row = [""] * len(header)
-        for key, val in (row_dict or {}).items():
-            k = (key or "").strip().lower()
-            if not k: continue
-            if k == "invoice_mtr":
-                continue
-            if k in idx_lower:
-                row[idx_lower[k]] = val
-        ws.append_row(row, value_input_option="USER_ENTERED")
+        pos = {}   # row_dict key -> column index (None = not written), lowercased once per batch
+        rows = []
+        for row_dict in row_dicts:
+            row = [""] * len(header)
+            for key, val in (row_dict or {}).items():
+                if key not in pos:
+                    k = (key or "").strip().lower()
+                    pos[key] = idx_lower.get(k) if k and k != "invoice_mtr" else None
+                i = pos[key]
+                if i is not None:
+                    row[i] = val
+            rows.append(row)
+        ws.append_rows(rows, value_input_option="USER_ENTERED", insert_data_option="INSERT_ROWS")
+        invalidate_caches("challans")
+        return True
     except Exception as e:
-        print("Append Challan failed:", e)
+        log.warning("Append Challan failed: %s", e, exc_info=True);  return False
+
+_MTR_KEYS = ("firm", "supplier code", "challan_number", "description")
+_MTR_COLS = []   # key-column letters by the last Challan header seen; re-checked on every write-back
 
 def write_invoice_mtr_to_challan(company_name, supplier_code, items):
     try:
         ws = _ws(CHALLAN_TAB_NAME)
-        all_values = ws.get_all_values()
-        if not all_values: return
-        header = [h.strip() for h in all_values[0]]
-        idx_lower = {h.strip().lower(): i for i, h in enumerate(header)}
+        # row 1 comes back in the same batch_get as the key columns, so a column the user
+        # moved since the last write-back is caught before anything is written
+        guess = _MTR_COLS[:]
+        got = ws.batch_get(["1:1"] + [f"{c}2:{c}" for c in guess])
+        header = [h.strip() for h in (got[0][0] if got[0] else [])]
+        if not header: return True
+        idx_lower = _header_index(header)
 
         if "invoice_mtr" not in idx_lower:
             header.append("INVOICE_MTR")
             ws.update('A1', [header])
-            all_values[0] = header
-            idx_lower = {h.strip().lower(): i for i, h in enumerate(header)}
-
-        updates = []
-        for row_num in range(2, len(all_values)+1):
-            row = all_values[row_num-1]
-            def get(colname):
-                i = idx_lower.get(colname.lower())
-                return (row[i].strip() if i is not None and i < len(row) else "")
-            firm   = get("Firm")
-            scode  = get("Supplier Code")
-            chno   = get("Challan_Number")
-            desc   = get("Description")
-            for (ch, d, sac, q, r, a) in items:
-                if (firm == company_name and scode == supplier_code and
-                    str(ch).strip() == str(chno).strip() and (d or "").strip() == (desc or "").strip()):
-                    col = idx_lower["invoice_mtr"] + 1
-                    updates.append((row_num, col, f"{float(q):.2f}"))
-                    break
-
-        if updates:
-            data = []
-            for r,c,val in updates:
-                a1 = gspread.utils.rowcol_to_a1(r, c)
-                data.append({'range': a1, 'values': [[val]]})
+            idx_lower = _header_index(header)
+
+        if not all(k in idx_lower for k in _MTR_KEYS): return True   # no such column: no row can match
+        cols = [_col_a1(idx_lower[k]) for k in _MTR_KEYS]
+        if cols != guess:   # first write-back, or the layout changed
+            _MTR_COLS[:] = cols
+            got = [None] + ws.batch_get([f"{c}2:{c}" for c in cols])
+        firms, scodes, chnos, descs = ([(r[0] if r else "") for r in v] for v in got[1:])
+
+        # (challan no, description) -> qty; first matching item wins
+        wanted = {}
+        for (ch, d, sac, q, r, a) in items:
+            wanted.setdefault((str(ch).strip(), (d or "").strip()), q)
+
+        def cell(col, i):
+            return str(col[i]).strip() if i < len(col) else ""
+
+        mtr_col = _col_a1(idx_lower["invoice_mtr"])   # fixed column: letters computed once
+        data = []
+        for i in range(max(len(firms), len(scodes), len(chnos), len(descs))):
+            if cell(firms, i) != company_name or cell(scodes, i) != supplier_code: continue
+            q = wanted.get((cell(chnos, i), cell(descs, i)))
+            if q is None: continue
+            data.append({'range': f"{mtr_col}{i + 2}", 'values': [[f"{float(q):.2f}"]]})
+
+        if data:
             ws.batch_update(data, value_input_option='USER_ENTERED')
+            invalidate_caches("challans")
+        return True
     except Exception as e:
-        print("write_invoice_mtr_to_challan error:", e)
+        log.warning("write_invoice_mtr_to_challan error: %s", e, exc_info=True);  return False
 
 # ==============================
 # Auth helper
@@ -421,6 +679,7 @@ def write_invoice_mtr_to_challan(company_name, supplier_code, items):
 def login_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
+        # signed session from a successful login; no Sheets round trip per page
         if not session.get("user"):
             return redirect(url_for("login"))
         return fn(*args, **kwargs)
@@ -429,19 +688,49 @@ def login_required(fn):
 # ==============================
 # PDF helpers
 # ==============================
+PDF_FONTS = ("Helvetica", "Helvetica-Bold")   # standard Type1, nothing to register
+
+def _warm_pdf():
+    # font metrics, encodings and reportlab's lazy imports load on first use; pay that at import
+    c = canvas.Canvas(io.BytesIO(), pagesize=A4)
+    for f in PDF_FONTS:
+        pdfmetrics.getFont(f); c.setFont(f, 9); c.drawString(0, 0, "0")
+    c.save()
+_warm_pdf()
+
+_FONT_WIDTHS = {f: pdfmetrics.getFont(f).widths for f in PDF_FONTS}   # Type1 glyph widths by code
+
+@lru_cache(maxsize=4096)
+def _sw(text, font, size):
+    w = _FONT_WIDTHS.get(font)
+    # printable ASCII has the same codes in WinAnsi, so index the width table directly (same
+    # sum and rounding as stringWidth); anything else may need encoding or font substitution
+    if w is not None and text.isascii() and text.isprintable():
+        return sum(map(w.__getitem__, map(ord, text))) * 0.001 * size
+    return pdfmetrics.stringWidth(text, font, size)
+
+@lru_cache(maxsize=512)   # challan copies and repeated party/bank text re-wrap the same strings
 def _wrap(text, max_width, font="Helvetica", size=9):
+    """Greedy word wrap -> tuple of lines (immutable: it is shared through the cache)."""
     text = (text or "").replace("\r"," ").replace("\n"," ").strip()
-    if not text: return [""]
-    words = text.split()
-    lines, line = [], ""
-    for w in words:
-        test = (line + " " + w).strip()
-        if pdfmetrics.stringWidth(test, font, size) <= max_width: line = test
+    if not text: return ("",)
+    # Type1 widths are additive: measure each word once, then keep a running line width
+    space_w = _sw(" ", font, size)
+    lines, line, line_w = [], [], 0.0
+    for w in text.split():
+        ww = _sw(w, font, size)
+        if line and line_w + space_w + ww <= max_width:
+            line.append(w); line_w += space_w + ww
         else:
-            if line: lines.append(line)
-            line = w
-    if line: lines.append(line)
-    return lines
+            if line: lines.append(" ".join(line))
+            line, line_w = [w], ww
+    if line: lines.append(" ".join(line))
+    return tuple(lines)
+
+@lru_cache(maxsize=64)
+def _firm_addr_lines(addr, max_width):
+    """Wrapped firm address for the header strip (static per firm, so computed once)."""
+    return _wrap(f"Address: {addr}", max_width)
 
 def _unique_name(base="file.pdf"):
     stem, ext = os.path.splitext(base)
@@ -450,67 +739,170 @@ def _unique_name(base="file.pdf"):
         name = f"{stem}_{i}{ext}"; i += 1
     return name
 
+_UNITS = ["","One","Two","Three","Four","Five","Six","Seven","Eight","Nine",
+          "Ten","Eleven","Twelve","Thirteen","Fourteen","Fifteen","Sixteen",
+          "Seventeen","Eighteen","Nineteen"]
+_TENS  = ["","Ten","Twenty","Thirty","Forty","Fifty","Sixty","Seventy","Eighty","Ninety"]
+
+def _two_words(x):
+    return _UNITS[x] if x < 20 else _TENS[x//10] + ((" " + _UNITS[x%10]) if x%10 else "")
+
+def _three_words(x):
+    h=x//100; r=x%100
+    return (_UNITS[h]+" Hundred " + _two_words(r)).strip() if h and r else (_UNITS[h]+" Hundred" if h else _two_words(r))
+
+_THREE = [_three_words(i) for i in range(1000)]   # every crore/lakh/thousand/unit group is a lookup
+
 def _num_words(n):
-    units = ["","One","Two","Three","Four","Five","Six","Seven","Eight","Nine",
-             "Ten","Eleven","Twelve","Thirteen","Fourteen","Fifteen","Sixteen",
-             "Seventeen","Eighteen","Nineteen"]
-    tens  = ["","Ten","Twenty","Thirty","Forty","Fifty","Sixty","Seventy","Eighty","Ninety"]
-    def two(x):
-        return units[x] if x < 20 else tens[x//10] + ((" " + units[x%10]) if x%10 else "")
-    def three(x):
-        h=x//100; r=x%100
-        return (units[h]+" Hundred " + two(r)).strip() if h and r else (units[h]+" Hundred" if h else two(r))
     if n == 0: return "Zero"
-    s=""; cr=n//10000000; n%=10000000
-    la=n//100000;  n%=100000
-    th=n//1000;    n%=1000
-    if cr: s+=three(cr)+" Crore "
-    if la: s+=three(la)+" Lakh "
-    if th: s+=three(th)+" Thousand "
-    if n:  s+=three(n)
-    return " ".join(s.split())
-
-def _rupees_words(v):  return f"{_num_words(int(round(v)))} Rupees Only"
+    cr, n = divmod(n, 10000000)
+    la, n = divmod(n, 100000)
+    th, n = divmod(n, 1000)
+    parts = []
+    if cr: parts += [_THREE[cr] if cr < 1000 else _three_words(cr), "Crore"]
+    if la: parts += [_THREE[la], "Lakh"]
+    if th: parts += [_THREE[th], "Thousand"]
+    if n:  parts.append(_THREE[n])
+    return " ".join(parts)
+
+@lru_cache(maxsize=4096)
+def _rupees_int_words(n):  return f"{_num_words(n)} Rupees Only"
+
+def _rupees_words(v):  return _rupees_int_words(int(round(v)))   # cache on the rounded rupee, not the float
+
+LOGO_MAX_BYTES = int(os.getenv("LOGO_MAX_BYTES", "2000000"))
+LOGO_RETRY_SECS = int(os.getenv("LOGO_RETRY_SECS", "300"))   # don't re-try a failed logo before this
+LOGO_CACHE_DIR = os.getenv("LOGO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "invoice_logos"))
+LOGO_REVALIDATE_SECS = int(os.getenv("LOGO_REVALIDATE_SECS", "86400"))  # disk copy age before a conditional GET
+LOGO_ACCEPT = "image/png,image/jpeg,image/*;q=0.8,*/*;q=0.5"
+LOGO_PX_PER_PT = float(os.getenv("LOGO_PX_PER_PT", "4"))   # keep ~288 dpi inside the largest logo box
+_LOGO_CACHE = {}   # blake2b(src) -> ImageReader
+_LOGO_MISSES = {}  # blake2b(src) -> monotonic time of the last failed load
 
 def _image_reader_from_src(src):
     if not src: return None
+    key = hashlib.blake2b(src.strip().encode(), digest_size=16).hexdigest()
+    img = _LOGO_CACHE.get(key)
+    if img is None:
+        miss = _LOGO_MISSES.get(key)
+        if miss is not None and time.monotonic() - miss < LOGO_RETRY_SECS: return None
+        img = _load_image_reader(src, key)
+        if img is not None: _LOGO_CACHE[key] = img; _LOGO_MISSES.pop(key, None)
+        else: _LOGO_MISSES[key] = time.monotonic()
+    return img
+
+_LOGO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="logo")
+
+def _prefetch_logos(srcs):
+    """Warm _LOGO_CACHE in parallel when firm profiles load, so the first PDF doesn't wait on a download."""
+    for src in {s.strip() for s in srcs if s and s.strip()}:
+        key = hashlib.blake2b(src.encode(), digest_size=16).hexdigest()
+        if key not in _LOGO_CACHE: _LOGO_POOL.submit(_image_reader_from_src, src)
+
+def _logo_disk_path(key):  return os.path.join(LOGO_CACHE_DIR, key + ".img")
+
+def _logo_meta_path(key):  return os.path.join(LOGO_CACHE_DIR, key + ".json")
+
+def _logo_disk_put(key, data, validators):
+    # best effort: lets other workers / restarts skip the download
+    try:
+        os.makedirs(LOGO_CACHE_DIR, exist_ok=True)
+        for path, blob in ((_logo_meta_path(key), json.dumps(validators).encode()), (_logo_disk_path(key), data)):
+            tmp = path + f".{os.getpid()}.tmp"
+            Path(tmp).write_bytes(blob); os.replace(tmp, path)
+    except OSError as e:
+        log.info("Logo disk cache write skipped: %s", e)
+
+def _logo_disk_get(key):
+    """(bytes, age in seconds, {'etag','last_modified'}) of the disk copy, or (None, None, {})."""
+    try:
+        p = Path(_logo_disk_path(key)); data = p.read_bytes(); age = time.time() - p.stat().st_mtime
+    except OSError:
+        return None, None, {}
+    try: validators = json.loads(Path(_logo_meta_path(key)).read_text())
+    except (OSError, ValueError): validators = {}
+    return data, age, validators
+
+def _logo_reader(data):
+    """ImageReader for logo bytes, downscaled once to what the logo box can show.
+
+    Every PDF embeds the logo; a multi-megapixel brand image would otherwise be
+    recompressed into each copy at full size.
+    """
+    box = (int(max(LOGO_MAX_W, 160) * LOGO_PX_PER_PT), int(max(LOGO_MAX_H, 50) * LOGO_PX_PER_PT))
+    try:
+        im = PILImage.open(io.BytesIO(data))
+        if min(box[0] / im.width, box[1] / im.height) < 0.5:   # only when it saves real pixels
+            fmt = im.format
+            im.thumbnail(box, PILImage.LANCZOS)   # in place, keeps aspect ratio
+            if fmt != "JPEG": return ImageReader(im)
+            # JPEGs are embedded as-is (DCT passthrough): re-encode as JPEG, keep whichever is smaller
+            out = io.BytesIO(); im.convert("RGB").save(out, "JPEG", quality=90)
+            if out.tell() < len(data): data = out.getvalue()
+    except Exception:
+        pass   # leave anything PIL can't handle to ImageReader as before
+    return ImageReader(io.BytesIO(data))
+
+def _load_image_reader(src, key):
     u = src.strip()
 
     if u.startswith("data:image/"):
         try:
             header, b64 = u.split(",", 1)
             data = base64.b64decode(b64)
-            return ImageReader(io.BytesIO(data))
+            return _logo_reader(data)
         except Exception as e:
-            print("Logo decode skipped:", e); return None
+            log.info("Logo decode skipped: %s", e); return None
 
     try:
         if os.path.exists(u):
             with open(u, "rb") as f:
-                return ImageReader(io.BytesIO(f.read()))
+                return _logo_reader(f.read())
         if not os.path.isabs(u):
             abs_candidate = os.path.join(app.root_path, u)
             if os.path.exists(abs_candidate):
                 with open(abs_candidate, "rb") as f:
-                    return ImageReader(io.BytesIO(f.read()))
+                    return _logo_reader(f.read())
     except Exception as e:
-        print("Logo local read skipped:", e)
+        log.info("Logo local read skipped: %s", e)
 
     if u.startswith("http://") or u.startswith("https://"):
+        cached, age, validators = _logo_disk_get(key)
+        if cached is not None and age < LOGO_REVALIDATE_SECS:
+            try: return _logo_reader(cached)
+            except Exception: cached = None
         u = _normalize_remote_url(u)
-        looks_like_page = not re.search(r"\.(jpg|jpeg|png|webp|gif)(\?|$)", u, re.I)
+        looks_like_page = not u.split("?", 1)[0].lower().endswith(_IMG_EXTS)
         if looks_like_page:
             og = _resolve_og_image(u)
             if og: u = og
+        headers = {"Accept": LOGO_ACCEPT}
+        if cached is not None:   # stale copy: revalidate, a 304 costs no body
+            if validators.get("etag"): headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"): headers["If-Modified-Since"] = validators["last_modified"]
         try:
-            r = HTTP.get(u, timeout=10)
-            r.raise_for_status()
-            ctype = r.headers.get("Content-Type","").lower()
-            if not (ctype.startswith("image/") or ctype.startswith("application/octet-stream")):
-                return None
-            return ImageReader(io.BytesIO(r.content))
+            with HTTP.get(u, timeout=10, stream=True, headers=headers) as r:
+                if r.status_code == 304 and cached is not None:
+                    os.utime(_logo_disk_path(key))
+                    return _logo_reader(cached)
+                r.raise_for_status()
+                ctype = r.headers.get("Content-Type","").lower()
+                if not (ctype.startswith("image/") or ctype.startswith("application/octet-stream")):
+                    return None
+                data = io.BytesIO()
+                for chunk in r.iter_content(64 * 1024):
+                    data.write(chunk)
+                    if data.tell() > LOGO_MAX_BYTES:
+                        log.info("Logo remote fetch skipped: larger than %d bytes", LOGO_MAX_BYTES); return None
+                validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+            img = _logo_reader(data.getvalue())
+            _logo_disk_put(key, data.getvalue(), validators)
+            return img
         except Exception as e:
-            print("Logo remote fetch skipped:", e); return None
+            if cached is not None:   # origin unreachable: a stale logo beats none
+                log.info("Logo revalidation failed, using cached copy: %s", e)
+                return _logo_reader(cached)
+            log.info("Logo remote fetch skipped: %s", e); return None
 
     return None
 
@@ -526,27 +918,57 @@ def _draw_logo(c, logo_src, x_right, y_top, max_w, max_h):
         h = ih * scale
         c.drawImage(img, x_right - w, y_top - h, w, h, preserveAspectRatio=True, mask='auto')
     except Exception as e:
-        print("Logo draw skipped:", e)
+        log.info("Logo draw skipped: %s", e)
 
 # ===== Saving to local disk (optional) =====
+_SAVE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="save")
+_DIR_CREATED = set()
+
 def _save_copy(kind, firm_name, filename, data_bytes):
     try:
         if not SAVE_DIR: return
         base = os.path.abspath(SAVE_DIR)
         sub  = os.path.join(base, kind, _firm_dir_name(firm_name or "Unknown"))
-        os.makedirs(sub, exist_ok=True)
+        if sub not in _DIR_CREATED:
+            os.makedirs(sub, exist_ok=True); _DIR_CREATED.add(sub)
         path = os.path.join(sub, filename)
-        with open(path, "wb") as f:
-            f.write(data_bytes)
-        print(f"Saved copy at: {path}")
+        # temp file in the same dir + os.replace: readers never see a half-written PDF
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.part"
+        try:
+            try: Path(tmp).write_bytes(data_bytes)
+            except FileNotFoundError:   # folder removed since _DIR_CREATED cached it
+                os.makedirs(sub, exist_ok=True); Path(tmp).write_bytes(data_bytes)
+            os.replace(tmp, path)
+        except BaseException:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+        log.info("Saved copy at: %s", path)
     except Exception as e:
-        print("Skip saving copy:", e)
+        log.warning("Skip saving copy: %s", e)
+
+def _save_copy_async(kind, firm_name, filename, buf):
+    """Write the server copy of a BytesIO off the request thread (no-op without SAVE_DIR)."""
+    if SAVE_DIR:
+        _SAVE_POOL.submit(_save_copy, kind, firm_name, filename, buf.getvalue())
+
+# ===== PDF rendering off the request thread (overlaps with Sheets I/O) =====
+_PDF_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pdf")
+
+def _render_pdf(draw_fn, *args, **kwargs):
+    """Draw into a BytesIO and hand it back rewound, ready for send_file."""
+    buf = io.BytesIO()
+    draw_fn(buf, *args, **kwargs)
+    buf.seek(0)
+    return buf
 
 # ==============================
 # DRAW HELPERS
 # ==============================
-def _hline(c, x1, x2, y): c.line(x1, y, x2, y)
-def _vline(c, x, y1, y2): c.line(x, y1, x, y2)
+# Borders/separators are collected into one path per PDF (p = c.beginPath())
+# and stroked once with c.drawPath(p, stroke=1, fill=0).
+def _hline(p, x1, x2, y): p.moveTo(x1, y); p.lineTo(x2, y)
+def _vline(p, x, y1, y2): p.moveTo(x, y1); p.lineTo(x, y2)
 
 # --------- Draw Challan (two copies; each with its own border) ---------
 def draw_challan_pdf(buf, company, party, meta, items):
@@ -561,7 +983,8 @@ def draw_challan_pdf(buf, company, party, meta, items):
 
     def one_copy(T, B):
         # Outer border for this copy
-        c.rect(L, B, R-L, T-B, stroke=1, fill=0)
+        p = c.beginPath()
+        p.rect(L, B, R-L, T-B)
 
         # Title band (light grey) — FILL ONLY, then bottom separator
         title_h = 22
@@ -570,22 +993,22 @@ def draw_challan_pdf(buf, company, party, meta, items):
         c.setFillColor(colors.black)
         c.setFont("Helvetica-Bold", 14)
         c.drawCentredString((L+R)/2, T-title_h+5, company["title_name"])
-        _hline(c, L, R, T-title_h-1)
+        _hline(p, L, R, T-title_h-1)
 
         # Firm info strip (cream) — FILL ONLY, then top+bottom separators
         y = T - title_h - 6
         c.setFillColorRGB(*FIRM_BG_RGB)
         c.rect(L+1, y-FIRM_BOX_H-2, R-L-2, FIRM_BOX_H, fill=1, stroke=0)
         c.setFillColor(colors.black)
-        _hline(c, L, R, y-FIRM_BOX_H-2)
-        _hline(c, L, R, y-2)
+        _hline(p, L, R, y-FIRM_BOX_H-2)
+        _hline(p, L, R, y-2)
 
         c.setFont("Helvetica-Bold", 11)
         c.drawString(L+10, y-14, f"DELIVERY CHALLAN - {company['title_name']}")
         c.setFont("Helvetica", 9)
         inner_w = (R-L-2) - 20
         ay = y - 30
-        for ln in _wrap(f"Address: {company['addr']}", inner_w - (LOGO_MAX_W + LOGO_TEXT_PAD)):
+        for ln in _firm_addr_lines(company['addr'], inner_w - (LOGO_MAX_W + LOGO_TEXT_PAD)):
             c.drawString(L+10, ay, ln); ay -= 12
         c.drawString(L+10, ay, f"Mobile: {company['mobile']}   |   GST No.: {company['gst']}")
         _draw_logo(c, company.get("logo"), x_right=R-12, y_top=y-4, max_w=LOGO_MAX_W, max_h=LOGO_MAX_H)
@@ -595,16 +1018,16 @@ def draw_challan_pdf(buf, company, party, meta, items):
 
         # Two-column info area (single box with middle divider)
         part_h = 90
-        _hline(c, L, R, y)                 # top edge
-        _hline(c, L, R, y - part_h)        # bottom edge
-        _vline(c, (L+R)/2, y, y - part_h)  # center divider
+        _hline(p, L, R, y)                 # top edge
+        _hline(p, L, R, y - part_h)        # bottom edge
+        _vline(p, (L+R)/2, y, y - part_h)  # center divider
 
         c.setFont("Helvetica-Bold", 10)
         c.drawString(L+10, y-16, f"Party Details - {party.get('name') or '—'}")
         c.setFont("Helvetica", 9)
         vals = " | ".join([v for v in [party.get('gstin'), party.get('mobile')] if v])
         if vals: c.drawString(L+10, y-32, vals)
-        label = "Address: "; lw = pdfmetrics.stringWidth(label, "Helvetica", 9)
+        label = "Address: "; lw = _sw(label, "Helvetica", 9)
         addr = _wrap((party.get('address') or ""), ((R-L)/2)-20 - lw)[:2]
         c.drawString(L+10, y-46, label + (addr[0] if addr else ""))
         if len(addr) > 1:
@@ -635,36 +1058,35 @@ def draw_challan_pdf(buf, company, party, meta, items):
         for w,h in zip(widths,headers):
             c.drawString(x+6, ytbl-12, h)
             x += w; x_positions.append(x)
-        _hline(c, L, R, ytbl-16)  # underline header
+        _hline(p, L, R, ytbl-16)  # underline header
 
         data_top_y = ytbl-16
         data_h = CH_MAX_ROWS*18
         for xp in x_positions[1:-1]:
-            _vline(c, xp, ytbl, ytbl - (16 + data_h))
-        _hline(c, L, R, data_top_y - data_h)  # bottom
+            _vline(p, xp, ytbl, ytbl - (16 + data_h))
+        _hline(p, L, R, data_top_y - data_h)  # bottom
 
         c.setFont("Helvetica", 9)
-        for r in range(CH_MAX_ROWS):
+        # only populated rows are drawn (the column lines already frame the empty ones)
+        x_desc = x_positions[1] + 6
+        x_no_r, x_mtr_r, x_rate_r, x_amt_r = (x_positions[i] - 6 for i in (1, 3, 4, 5))
+        total_val = 0.0   # totalled while drawing, like the invoice
+        for r, it in enumerate(items[:CH_MAX_ROWS]):
             row_y = data_top_y - (r*18) - 12
-            x = L
-            if r < len(items): c.drawRightString(x+w_no-6, row_y, str(r+1))
-            x += w_no
-            if r < len(items): c.drawString(x+6, row_y, (items[r][0] or "")[:60])
-            x += w_desc
-            if r < len(items): c.drawRightString(x+w_mtr-6, row_y, f"{float(items[r][1]):.2f}")
-            x += w_mtr
-            if r < len(items): c.drawRightString(x+w_rate-6, row_y, f"{float(items[r][2]):.2f}")
-            x += w_rate
-            if r < len(items): c.drawRightString(x+w_amt-6, row_y, f"{float(items[r][3]):.2f}")
+            amt = float(it[3]); total_val += amt
+            c.drawRightString(x_no_r, row_y, str(r+1))
+            c.drawString(x_desc, row_y, (it[0] or "")[:60])
+            c.drawRightString(x_mtr_r, row_y, f"{float(it[1]):.2f}")
+            c.drawRightString(x_rate_r, row_y, f"{float(it[2]):.2f}")
+            c.drawRightString(x_amt_r, row_y, f"{amt:.2f}")
 
         # Grand total band (lines only)
         sub_y_top = data_top_y - data_h
-        _hline(c, L, R, sub_y_top)
-        _hline(c, L, R, sub_y_top-18)
-        _vline(c, L + (table_w - w_amt), sub_y_top, sub_y_top-18)
+        _hline(p, L, R, sub_y_top)
+        _hline(p, L, R, sub_y_top-18)
+        _vline(p, L + (table_w - w_amt), sub_y_top, sub_y_top-18)
         c.setFont("Helvetica-Bold", 9)
         c.drawString(L+7, sub_y_top-12, "Grand Total (₹)")
-        total_val = sum(float(a) for *_, a in items)
         c.drawRightString(R-6, sub_y_top-12, f"{total_val:.2f}")
 
         # --- Signatures (INSIDE the border; adjust via CHALLAN_SIG_OFFSET) ---
@@ -673,14 +1095,21 @@ def draw_challan_pdf(buf, company, party, meta, items):
         c.drawString(L+10, sig_y, "Receiver's Signature")
         c.drawRightString(R-10, sig_y, "Authorised Signatory")
 
-    # copies
+        c.drawPath(p, stroke=1, fill=0)
+
+    # copies: both are identical, so record one as a form XObject and place it twice
     T1 = page_top
     B1 = T1 - copy_h
+    c.beginForm("challan_copy", lowerx=L-1, lowery=B1-1, upperx=R+1, uppery=T1+1)
     one_copy(T1, B1)
+    c.endForm()
+    c.doForm("challan_copy")
 
     T2 = B1 - copy_gap
-    B2 = page_bottom
-    one_copy(T2, B2)
+    c.saveState()
+    c.translate(0, T2 - T1)
+    c.doForm("challan_copy")
+    c.restoreState()
 
     c.save()
 
@@ -692,7 +1121,8 @@ def draw_invoice_pdf(buf, company, supplier, inv_meta, items, discount):
     c.setLineWidth(0.7)
 
     # Outer page border
-    c.rect(L, B, R-L, T-B, stroke=1, fill=0)
+    p = c.beginPath()
+    p.rect(L, B, R-L, T-B)
 
     # Title band — FILL ONLY, then bottom separator
     band_h = 26
@@ -701,22 +1131,22 @@ def draw_invoice_pdf(buf, company, supplier, inv_meta, items, discount):
     c.setFillColor(colors.black)
     c.setFont("Helvetica-Bold", 16)
     c.drawCentredString((L+R)/2, T-band_h+6, company["title_name"])
-    _hline(c, L, R, T-band_h-1)
+    _hline(p, L, R, T-band_h-1)
 
     # Firm strip — FILL ONLY, then top+bottom separators
     y = T-band_h-6
     c.setFillColorRGB(*FIRM_BG_RGB)
     c.rect(L+1, y-FIRM_BOX_H-2, R-L-2, FIRM_BOX_H, fill=1, stroke=0)
     c.setFillColor(colors.black)
-    _hline(c, L, R, y-FIRM_BOX_H-2)
-    _hline(c, L, R, y-2)
+    _hline(p, L, R, y-FIRM_BOX_H-2)
+    _hline(p, L, R, y-2)
 
     c.setFont("Helvetica-Bold", 12)
     c.drawString(L+10, y-14, f"TAX INVOICE - {company['title_name']}")
     c.setFont("Helvetica", 9)
     inner_w = (R - L - 2) - 20
     ay = y - 30
-    for ln in _wrap(f"Address: {company['addr']}", inner_w - (LOGO_MAX_W + LOGO_TEXT_PAD)):
+    for ln in _firm_addr_lines(company['addr'], inner_w - (LOGO_MAX_W + LOGO_TEXT_PAD)):
         c.drawString(L+10, ay, ln); ay -= 12
     c.drawString(L+10, ay, f"Mobile: {company['mobile']}   |   GST No.: {company['gst']}")
     _draw_logo(c, company.get("logo"), x_right=R-12, y_top=y-4,  max_w=160, max_h=50)
@@ -726,9 +1156,9 @@ def draw_invoice_pdf(buf, company, supplier, inv_meta, items, discount):
 
     # Two info boxes with center divider
     part_h = 110
-    _hline(c, L, R, y)
-    _hline(c, L, R, y - part_h)
-    _vline(c, (L+R)/2, y, y - part_h)
+    _hline(p, L, R, y)
+    _hline(p, L, R, y - part_h)
+    _vline(p, (L+R)/2, y, y - part_h)
 
     c.setFont("Helvetica-Bold", 10)
     c.drawString(L+8, y-18, "Supplier details")
@@ -763,31 +1193,27 @@ def draw_invoice_pdf(buf, company, supplier, inv_meta, items, discount):
     for w,h in zip(widths,headers):
         c.drawString(x+6, ytbl-12, h)
         x += w; x_positions.append(x)
-    _hline(c, L, R, ytbl-16)
+    _hline(p, L, R, ytbl-16)
 
     data_top_y = ytbl-16
     data_h = INV_MAX_ROWS*18
     for xp in x_positions[1:-1]:
-        _vline(c, xp, ytbl, ytbl - (16 + data_h))
-    _hline(c, L, R, data_top_y - data_h)
+        _vline(p, xp, ytbl, ytbl - (16 + data_h))
+    _hline(p, L, R, data_top_y - data_h)
 
     c.setFont("Helvetica", 9)
-    for r in range(INV_MAX_ROWS):
+    x_ch, x_desc, x_sac = (xp+6 for xp in x_positions[:3])
+    x_mtr_r, x_rate_r, x_amt_r = (xp-6 for xp in x_positions[4:])
+    sub_total = 0.0   # totalled while drawing: one pass over the rows
+    for r, it in enumerate(items[:INV_MAX_ROWS]):
         row_y = data_top_y - (r*18) - 12
-        x = L
-        if r < len(items): c.drawString(x+6, row_y, str(items[r][0] or ""))
-        x += w_ch
-        if r < len(items): c.drawString(x+6, row_y, (items[r][1] or "")[:50])
-        x += w_desc
-        if r < len(items): c.drawString(x+6, row_y, items[r][2] or SAC_DEFAULT)
-        x += w_sac
-        if r < len(items): c.drawRightString(x+w_mtr-6, row_y, f"{float(items[r][3]):.2f}")
-        x += w_mtr
-        if r < len(items): c.drawRightString(x+w_rate-6, row_y, f"{float(items[r][4]):.2f}")
-        x += w_rate
-        if r < len(items): c.drawRightString(x+w_amt-6, row_y, f"{float(items[r][5]):.2f}")
-
-    sub_total = sum(float(i[5]) for i in items)
+        amt = float(it[5]); sub_total += amt
+        c.drawString(x_ch, row_y, str(it[0] or ""))
+        c.drawString(x_desc, row_y, (it[1] or "")[:50])
+        c.drawString(x_sac, row_y, it[2] or SAC_DEFAULT)
+        c.drawRightString(x_mtr_r, row_y, f"{float(it[3]):.2f}")
+        c.drawRightString(x_rate_r, row_y, f"{float(it[4]):.2f}")
+        c.drawRightString(x_amt_r, row_y, f"{amt:.2f}")
     discount = float(discount or 0)
     taxable = max(sub_total - discount, 0.0)
     cgst = taxable * (CGST_RATE/100.0)
@@ -798,12 +1224,12 @@ def draw_invoice_pdf(buf, company, supplier, inv_meta, items, discount):
 
     # Subtotal band (lines only)
     sub_y_top = data_top_y - data_h
-    _hline(c, L, R, sub_y_top)
-    _hline(c, L, R, sub_y_top-18)
+    _hline(p, L, R, sub_y_top)
+    _hline(p, L, R, sub_y_top-18)
     split_x1 = L + (w_ch + w_desc + w_sac + w_mtr)
     split_x2 = R - w_amt
-    _vline(c, split_x1, sub_y_top, sub_y_top-18)
-    _vline(c, split_x2, sub_y_top, sub_y_top-18)
+    _vline(p, split_x1, sub_y_top, sub_y_top-18)
+    _vline(p, split_x2, sub_y_top, sub_y_top-18)
 
     c.setFont("Helvetica-Bold", 9)
     c.drawString(L+7, sub_y_top-12, "Sub Total")
@@ -814,10 +1240,10 @@ def draw_invoice_pdf(buf, company, supplier, inv_meta, items, discount):
     bottom_h = 200
     left_w2 = (R-L)/2
     words_h = 110
-    _hline(c, L, R, ybot)
-    _hline(c, L, R, ybot-bottom_h)
-    _vline(c, L+left_w2, ybot, ybot-bottom_h)
-    _hline(c, L, L+left_w2, ybot-words_h)
+    _hline(p, L, R, ybot)
+    _hline(p, L, R, ybot-bottom_h)
+    _vline(p, L+left_w2, ybot, ybot-bottom_h)
+    _hline(p, L, L+left_w2, ybot-words_h)
 
     c.setFont("Helvetica-Bold", 10); c.drawString(L+8, ybot-16, "Amounts in Words:")
     c.setFont("Helvetica", 9)
@@ -856,11 +1282,111 @@ def draw_invoice_pdf(buf, company, supplier, inv_meta, items, discount):
     c.drawRightString(R-10, B+22, f"For {company['company_name']}")
     c.drawRightString(R-10, B+8, "Authorised Signatory")
 
+    c.drawPath(p, stroke=1, fill=0)
     c.save()
 
 # ==============================
 # Templates (in-memory) + Loader overlay
 # ==============================
+# Shared CSS, served from /assets/app.css?v=<hash> so browsers cache it across pages
+APP_CSS = r"""
+:root { --blue:#2563eb; --grey:#6b7280; --b:#e5e7eb; --text:#111827; }
+body { font-family: system-ui, -apple-system, "Segoe UI", Roboto, Arial, sans-serif; margin: 18px; color: var(--text); }
+header { display: flex; align-items: center; justify-content: space-between; margin-bottom: 16px; }
+.btn { display:inline-block; padding:8px 12px; background:var(--blue); color:white; text-decoration:none; border-radius:6px; border:0; cursor:pointer; }
+.btn.secondary { background:var(--grey); }
+.btn.small { padding:6px 10px; font-size: 14px; }
+.card { border:1px solid var(--b); border-radius:10px; padding:16px; margin:12px 0; }
+input, select, textarea { padding:8px; border:1px solid #cbd5e1; border-radius:6px; width: 100%; box-sizing: border-box; }
+table { border-collapse: collapse; width:100%; }
+th, td { border:1px solid #e5e7eb; padding:8px; text-align:left; }
+th.right, td.right { text-align:right; }
+.row { display:flex; gap:12px; flex-wrap:wrap; }
+.grow { flex:1 1 250px; }
+.right { text-align:right; }
+.msg { color:#dc2626; margin-bottom:8px; }
+label { font-size: 13px; color:#374151; }
+
+/* Loader overlay */
+#loaderOverlay {
+  position: fixed; inset: 0; background: rgba(17,17,17,0.45);
+  display: none; align-items: center; justify-content: center; z-index: 9999;
+}
+.loaderBox { background: white; padding: 16px 18px; border-radius: 10px; box-shadow: 0 10px 25px rgba(0,0,0,.25); display:flex; align-items:center; gap:12px; }
+.spinner {
+  width: 36px; height: 36px; border-radius: 50%;
+  border: 4px solid #e5e7eb; border-top-color: #111827; animation: spin 1s linear infinite;
+}
+@keyframes spin { to { transform: rotate(360deg); } }
+"""
+APP_CSS_HASH = hashlib.blake2b(APP_CSS.encode(), digest_size=6).hexdigest()
+
+# Shared page script (loader, messages, PDF download), served like APP_CSS
+APP_JS = r"""
+const FNAME_RE = /filename\*=UTF-8''([^;]+)|filename="?([^"]+)"?/i;   // Content-Disposition -> download name
+function showLoader(text){
+  const o = document.getElementById('loaderOverlay');
+  document.getElementById('loaderText').textContent = text || 'Loading…';
+  o.style.display = 'flex';
+}
+function hideLoader(){
+  const o = document.getElementById('loaderOverlay');
+  o.style.display = 'none';
+}
+function showMsg(text){   // same spot as flashed errors; '' hides it
+  const m = document.getElementById('pageMsg');
+  m.textContent = text || '';
+  m.style.display = text ? '' : 'none';
+}
+// non-OK fetch -> {"error": ...} from the server, shown in place of a redirect + flash
+async function showFetchError(res, fallback){
+  let msg = fallback;
+  try{ msg = (await res.json()).error || fallback; }catch(_){}
+  showMsg(msg);
+}
+// Show loader on navigation clicks
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('a').forEach(a=>{
+    a.addEventListener('click', (e)=>{
+      const href = a.getAttribute('href')||'';
+      if (!href || href.startsWith('#') || a.hasAttribute('download') || a.target === '_blank') return;
+      showLoader('Loading…');
+    });
+  });
+  // Hide if browser restores from bfcache
+  window.addEventListener('pageshow', ()=> hideLoader());
+});
+
+// POST a form, save the returned PDF under its Content-Disposition name, then run onDone()
+function submitAndDownload(form, {url, button, label, fallbackName, onDone}){
+  form.addEventListener('submit', async (e)=>{
+    e.preventDefault();
+    button.disabled = true;
+    showLoader(label);
+    try{
+      const res = await fetch(url, { method: "POST", body: new FormData(form), credentials: "same-origin" });
+      if(!res.ok){ await showFetchError(res, "Failed to generate PDF"); return; }
+      showMsg(res.headers.get('X-Sheet-Warning') || '');   // PDF issued, but a follow-up sheet write failed
+      const blob = await res.blob();
+      const m = FNAME_RE.exec(res.headers.get('Content-Disposition') || '');
+      const fname = decodeURIComponent((m && (m[1]||m[2])) || fallbackName);
+      const href = URL.createObjectURL(blob);
+      const a = document.createElement('a'); a.href = href; a.download = fname; document.body.appendChild(a); a.click();
+      setTimeout(()=>{ URL.revokeObjectURL(href); a.remove(); }, 500);
+      form.reset();
+      if(onDone) onDone();
+    }catch(err){
+      console.error(err);
+    }finally{
+      hideLoader();
+      button.disabled = false;
+    }
+  });
+}
+window.BillingForms = { submitAndDownload };
+"""
+APP_JS_HASH = hashlib.blake2b(APP_JS.encode(), digest_size=6).hexdigest()
+
 TEMPLATES = {
 "base.html": r"""
 <!doctype html>
@@ -869,36 +1395,8 @@ TEMPLATES = {
   <meta charset="utf-8">
   <title>{{ title or "Billing App" }}</title>
   <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <style>
-    :root { --blue:#2563eb; --grey:#6b7280; --b:#e5e7eb; --text:#111827; }
-    body { font-family: system-ui, -apple-system, "Segoe UI", Roboto, Arial, sans-serif; margin: 18px; color: var(--text); }
-    header { display: flex; align-items: center; justify-content: space-between; margin-bottom: 16px; }
-    .btn { display:inline-block; padding:8px 12px; background:var(--blue); color:white; text-decoration:none; border-radius:6px; border:0; cursor:pointer; }
-    .btn.secondary { background:var(--grey); }
-    .btn.small { padding:6px 10px; font-size: 14px; }
-    .card { border:1px solid var(--b); border-radius:10px; padding:16px; margin:12px 0; }
-    input, select, textarea { padding:8px; border:1px solid #cbd5e1; border-radius:6px; width: 100%; box-sizing: border-box; }
-    table { border-collapse: collapse; width:100%; }
-    th, td { border:1px solid #e5e7eb; padding:8px; text-align:left; }
-    th.right, td.right { text-align:right; }
-    .row { display:flex; gap:12px; flex-wrap:wrap; }
-    .grow { flex:1 1 250px; }
-    .right { text-align:right; }
-    .msg { color:#dc2626; margin-bottom:8px; }
-    label { font-size: 13px; color:#374151; }
-
-    /* Loader overlay */
-    #loaderOverlay {
-      position: fixed; inset: 0; background: rgba(17,17,17,0.45);
-      display: none; align-items: center; justify-content: center; z-index: 9999;
-    }
-    .loaderBox { background: white; padding: 16px 18px; border-radius: 10px; box-shadow: 0 10px 25px rgba(0,0,0,.25); display:flex; align-items:center; gap:12px; }
-    .spinner {
-      width: 36px; height: 36px; border-radius: 50%;
-      border: 4px solid #e5e7eb; border-top-color: #111827; animation: spin 1s linear infinite;
-    }
-    @keyframes spin { to { transform: rotate(360deg); } }
-  </style>
+  <link rel="stylesheet" href="{{ url_for('app_css', v=APP_CSS_HASH) }}">
+  <script src="{{ url_for('app_js', v=APP_JS_HASH) }}"></script>
 </head>
 <body>
   <header>
@@ -914,9 +1412,7 @@ TEMPLATES = {
   </header>
 
   {% with messages = get_flashed_messages(category_filter=["error"]) %}
-    {% if messages %}
-      <div class="msg">{{ messages[0] }}</div>
-    {% endif %}
+    <div class="msg" id="pageMsg"{% if not messages %} style="display:none"{% endif %}>{{ messages[0] if messages }}</div>
   {% endwith %}
 
   {% block content %}{% endblock %}
@@ -929,29 +1425,6 @@ TEMPLATES = {
     </div>
   </div>
 
-  <script>
-    function showLoader(text){
-      const o = document.getElementById('loaderOverlay');
-      document.getElementById('loaderText').textContent = text || 'Loading…';
-      o.style.display = 'flex';
-    }
-    function hideLoader(){
-      const o = document.getElementById('loaderOverlay');
-      o.style.display = 'none';
-    }
-    // Show loader on navigation clicks
-    document.addEventListener('DOMContentLoaded', () => {
-      document.querySelectorAll('a').forEach(a=>{
-        a.addEventListener('click', (e)=>{
-          const href = a.getAttribute('href')||'';
-          if (!href || href.startsWith('#') || a.hasAttribute('download') || a.target === '_blank') return;
-          showLoader('Loading…');
-        });
-      });
-      // Hide if browser restores from bfcache
-      window.addEventListener('pageshow', ()=> hideLoader());
-    });
-  </script>
 </body>
 </html>
 """,
@@ -1004,12 +1477,21 @@ TEMPLATES = {
 <div class="row">
   <a class="btn" href="{{ url_for('challan') }}">Create Challan</a>
   <a class="btn" href="{{ url_for('invoice') }}">Create Invoice</a>
+  <form method="post" action="{{ url_for('admin_refresh') }}" style="margin:0">
+    <button class="btn secondary" type="submit">Reload sheet data</button>
+  </form>
 </div>
 {% endblock %}
 """,
 "challan.html": r"""
 {% extends "base.html" %}
 {% block content %}
+{% macro item_cells() %}   {# one item row's cells: initial row + JS ROW_PROTO #}
+    <td><input name="desc[]" required></td>
+    <td class="right"><input name="qty[]" type="number" step="0.01" min="0.01" required></td>
+    <td class="right"><input name="rate[]" type="number" step="0.01" min="0" required></td>
+    <td><button class="btn secondary small" type="button" onclick="this.closest('tr').remove()">Delete</button></td>
+{% endmacro %}
 <h2>Create Challan</h2>
 
 <form id="challanForm" method="post" class="card">
@@ -1060,7 +1542,7 @@ TEMPLATES = {
   <h3>Items (max {{ CH_MAX_ROWS }})</h3>
   <table id="items">
     <thead><tr><th>Description</th><th class="right">MTR</th><th class="right">Rate</th><th></th></tr></thead>
-    <tbody></tbody>
+    <tbody><tr>{{ item_cells() }}</tr></tbody>   <!-- first row server-rendered: usable before JS runs -->
   </table>
   <p><button type="button" class="btn small" onclick="addRow()">Add Row</button></p>
 
@@ -1068,7 +1550,8 @@ TEMPLATES = {
 </form>
 
 <script>
-const SUPPLIERS = {{ suppliers|tojson }};
+{% if suppliers %}
+const SUPPLIERS = {{ suppliers_json }};
 
 function fillParty(){
   const code = document.getElementById('ch_party_code').value;
@@ -1080,43 +1563,20 @@ function fillParty(){
 }
 document.getElementById('ch_party_code').addEventListener('change', fillParty);
 document.getElementById('ch_party_code').addEventListener('blur', fillParty);
+{% endif %}
+
+const itemsBody = document.querySelector('#items tbody');
+const ROW_PROTO = document.createElement('tr');   // parsed once, cloned per row
+ROW_PROTO.innerHTML = `{{ item_cells() }}`;
 
 function addRow(){
-  const tr = document.createElement('tr');
-  tr.innerHTML = `
-    <td><input name="desc[]" required></td>
-    <td class="right"><input name="qty[]" type="number" step="0.01" min="0.01" required></td>
-    <td class="right"><input name="rate[]" type="number" step="0.01" min="0" required></td>
-    <td><button class="btn secondary small" type="button" onclick="this.closest('tr').remove()">Delete</button></td>`;
-  document.querySelector('#items tbody').appendChild(tr);
+  itemsBody.appendChild(ROW_PROTO.cloneNode(true));
 }
-addRow();
 
-document.getElementById('challanForm').addEventListener('submit', async (e)=>{
-  e.preventDefault();
-  const btn = document.getElementById('ch_submit');
-  btn.disabled = true;
-  showLoader('Saving challan…');
-  try{
-    const fd = new FormData(e.target);
-    const res = await fetch("{{ url_for('challan') }}", { method: "POST", body: fd, credentials: "same-origin" });
-    if(!res.ok) throw new Error("Failed to generate PDF");
-    const blob = await res.blob();
-    const dispo = res.headers.get('Content-Disposition') || '';
-    const m = /filename\*=UTF-8''([^;]+)|filename="?([^"]+)"?/i.exec(dispo);
-    const fname = decodeURIComponent((m && (m[1]||m[2])) || 'challan.pdf');
-    const url = URL.createObjectURL(blob);
-    const a = document.createElement('a'); a.href = url; a.download = fname; document.body.appendChild(a); a.click();
-    setTimeout(()=>{ URL.revokeObjectURL(url); a.remove(); }, 500);
-    e.target.reset();
-    document.querySelector('#items tbody').innerHTML = '';
-    addRow();
-  }catch(err){
-    console.error(err);
-  }finally{
-    hideLoader();
-    btn.disabled = false;
-  }
+BillingForms.submitAndDownload(document.getElementById('challanForm'), {
+  url: "{{ url_for('challan') }}", button: document.getElementById('ch_submit'),
+  label: 'Saving challan…', fallbackName: 'challan.pdf',
+  onDone(){ itemsBody.replaceChildren(); addRow(); },
 });
 </script>
 {% endblock %}
@@ -1124,6 +1584,13 @@ document.getElementById('challanForm').addEventListener('submit', async (e)=>{
 "invoice.html": r"""
 {% extends "base.html" %}
 {% block content %}
+{% macro item_cells() %}   {# one item row's cells: initial row + JS ROW_PROTO #}
+    <td><input name="ch[]"></td>
+    <td><input name="desc[]" required></td>
+    <td class="right"><input name="qty[]"  type="number" step="0.01" min="0.01" required></td>
+    <td class="right"><input name="rate[]" type="number" step="0.01" min="0" required></td>
+    <td><button class="btn secondary small" type="button" onclick="this.closest('tr').remove()">Delete</button></td>
+{% endmacro %}
 <h2>Create Invoice</h2>
 
 <form id="invoiceForm" method="post" class="card">
@@ -1200,7 +1667,7 @@ document.getElementById('challanForm').addEventListener('submit', async (e)=>{
         <th>Ch. No</th><th>Description</th><th class="right">MTR</th><th class="right">Rate</th><th></th>
       </tr>
     </thead>
-    <tbody></tbody>
+    <tbody><tr>{{ item_cells() }}</tr></tbody>   <!-- first row server-rendered: usable before JS runs -->
   </table>
   <p><button type="button" class="btn small" onclick="addRow()">Add Row</button></p>
 
@@ -1208,25 +1675,33 @@ document.getElementById('challanForm').addEventListener('submit', async (e)=>{
 </form>
 
 <script>
-const SUPPLIERS    = {{ suppliers|tojson }};
-const CHALLAN_ROWS = {{ challans|tojson }};
+let   CH_GROUPS    = {};   // {challan no: [open rows]} of the selected firm+supplier (/api/challans)
+let   CH_SEQ       = 0;
 const INV_MAX_ROWS = {{ INV_MAX_ROWS|int }};
 
-function addRow(prefill){
-  const tr = document.createElement('tr');
-  tr.innerHTML = `
-    <td><input name="ch[]"  value="${prefill?.ch ?? ''}"></td>
-    <td><input name="desc[]" value="${prefill?.desc ?? ''}" required></td>
-    <td class="right"><input name="qty[]"  type="number" step="0.01" min="0.01" value="${prefill?.qty ?? ''}" required></td>
-    <td class="right"><input name="rate[]" type="number" step="0.01" min="0"     value="${prefill?.rate ?? ''}" required></td>
-    <td><button class="btn secondary small" type="button" onclick="this.closest('tr').remove()">Delete</button></td>`;
-  document.querySelector('#items tbody').appendChild(tr);
+const itemsBody  = document.querySelector('#items tbody');
+const firmEl     = document.getElementById('inv_firm');
+const scodeEl    = document.getElementById('inv_supplier_code');
+const challanSel = document.getElementById('inv_import_challan');
+const ROW_PROTO  = document.createElement('tr');   // parsed once, cloned per row
+ROW_PROTO.innerHTML = `{{ item_cells() }}`;
+
+function addRow(prefill, parent = itemsBody){
+  const tr = ROW_PROTO.cloneNode(true);
+  if(prefill){   // set as properties: quotes/markup in sheet text can't break the row
+    const [ch, desc, qty, rate] = tr.querySelectorAll('input');
+    ch.value = prefill.ch ?? ''; desc.value = prefill.desc ?? '';
+    qty.value = prefill.qty ?? ''; rate.value = prefill.rate ?? '';
+  }
+  parent.appendChild(tr);
   return tr;
 }
-addRow(); // one empty row
+
+{% if suppliers %}   {# no suppliers: the code select is empty, so there is nothing to fill or filter by #}
+const SUPPLIERS = {{ suppliers_json }};
 
 function fillSupplier(){
-  const code = document.getElementById('inv_supplier_code').value;
+  const code = scodeEl.value;
   const s = SUPPLIERS[code];
   if(s){
     document.getElementById('inv_name').value    = s.name   || '';
@@ -1236,61 +1711,51 @@ function fillSupplier(){
   }
   refreshChallanOptions();
 }
-document.getElementById('inv_supplier_code').addEventListener('change', fillSupplier);
-document.getElementById('inv_supplier_code').addEventListener('blur', fillSupplier);
-document.getElementById('inv_firm').addEventListener('change', refreshChallanOptions);
-
-function refreshChallanOptions(){
-  const firm  = (document.getElementById('inv_firm').value || '').toUpperCase();
-  const scode = document.getElementById('inv_supplier_code').value || '';
-  const sel   = document.getElementById('inv_import_challan');
-  sel.innerHTML = '<option value="">-- select challan --</option>';
+scodeEl.addEventListener('change', fillSupplier);
+scodeEl.addEventListener('blur', fillSupplier);
+firmEl.addEventListener('change', refreshChallanOptions);
+window.addEventListener('DOMContentLoaded', ()=>{ refreshChallanOptions(); });
+{% endif %}
+
+async function refreshChallanOptions(){
+  const firm  = (firmEl.value || '').toUpperCase();
+  const scode = scodeEl.value || '';
+  const seq   = ++CH_SEQ;
+  challanSel.innerHTML = '<option value="">-- select challan --</option>';
+  CH_GROUPS = {};
   if(!firm || !scode) return;
 
-  const grouped = {};
-  CHALLAN_ROWS.forEach(r=>{
-    const rf = String(r['Firm']||'').toUpperCase();
-    const rc = String(r['Supplier Code']||'');
-    if(rf!==firm || rc!==scode) return;
-    const ch = String(r['Challan_Number']||'').trim();
-    if(!ch) return;
-    if(!grouped[ch]) grouped[ch] = [];
-    grouped[ch].push(r);
-  });
-
-  Object.keys(grouped).sort().forEach(ch=>{
-    const rows = grouped[ch];
-    const hasUninvoiced = rows.some(x => String(x['INVOICE_MTR']||'').trim() === '');
-    if(!hasUninvoiced) return;
-    const firstDesc = (rows.find(x => String(x['INVOICE_MTR']||'').trim() === '')?.['Description']) || rows[0]['Description'] || '';
-    const short = String(firstDesc).slice(0,28);
+  let groups = {};
+  try{
+    const q = new URLSearchParams({ firm: firm, supplier: scode });
+    const res = await fetch("{{ url_for('api_challans') }}?" + q, { credentials: "same-origin" });
+    if(res.ok) groups = await res.json();
+  }catch(err){ console.error(err); }
+  if(seq !== CH_SEQ) return;   // a newer firm/supplier change superseded this one
+  CH_GROUPS = groups;
+
+  Object.keys(groups).sort().forEach(ch=>{
+    const short = String(groups[ch][0]['Description'] ?? '').slice(0,28);
     const opt = document.createElement('option');
     opt.value = ch; opt.textContent = short ? `${ch} (${short})` : ch;
-    sel.appendChild(opt);
+    challanSel.appendChild(opt);
   });
 }
 
 function safeNum(v){ const n = Number(v); return isNaN(n)?0:n; }
 
 function addFromChallan(){
-  const firm  = (document.getElementById('inv_firm').value || '').toUpperCase();
-  const scode = document.getElementById('inv_supplier_code').value || '';
-  const chSel = document.getElementById('inv_import_challan').value || '';
+  const firm  = (firmEl.value || '').toUpperCase();
+  const scode = scodeEl.value || '';
+  const chSel = challanSel.value || '';
   if(!firm || !scode || !chSel) return;
 
-  const rows = CHALLAN_ROWS.filter(r =>
-    String(r['Firm']||'').toUpperCase() === firm &&
-    String(r['Supplier Code']||'') === scode &&
-    String(r['Challan_Number']||'').trim() === chSel &&
-    String(r['INVOICE_MTR']||'').trim() === ''
-  );
-
-  const tbody = document.querySelector('#items tbody');
-  let current = tbody.querySelectorAll('tr').length;
+  const rows = CH_GROUPS[chSel] || [];
 
-  for(const r of rows){
-    if(current >= INV_MAX_ROWS) break;
+  const room = Math.max(INV_MAX_ROWS - itemsBody.rows.length, 0);   // UX cap only; the server slices too
+  const frag = document.createDocumentFragment();   // one insert/layout for the whole challan
 
+  for(const r of rows.slice(0, room)){
     const desc   = String(r['Description']||'');
     const qtyRaw = (r['Qty'] !== undefined && r['Qty'] !== "") ? r['Qty'] : (r['MTR'] ?? '');
     const qtyStr = String(qtyRaw ?? '');
@@ -1311,47 +1776,55 @@ function addFromChallan(){
       }
     }
 
-    addRow({ ch: chSel, desc: desc, qty: qtyStr, rate: rate });
-    current++;
+    addRow({ ch: chSel, desc: desc, qty: qtyStr, rate: rate }, frag);
   }
+  itemsBody.appendChild(frag);
 }
 
-window.addEventListener('DOMContentLoaded', ()=>{ refreshChallanOptions(); });
-
-document.getElementById('invoiceForm').addEventListener('submit', async (e)=>{
-  e.preventDefault();
-  const btn = document.getElementById('inv_submit');
-  btn.disabled = true;
-  showLoader('Saving invoice…');
-  try{
-    const fd = new FormData(e.target);
-    const res = await fetch("{{ url_for('invoice') }}", { method: "POST", body: fd, credentials: "same-origin" });
-    if(!res.ok) throw new Error("Failed to generate PDF");
-    const blob = await res.blob();
-    const dispo = res.headers.get('Content-Disposition') || '';
-    const m = /filename\*=UTF-8''([^;]+)|filename="?([^"]+)"?/i.exec(dispo);
-    const fname = decodeURIComponent((m && (m[1]||m[2])) || 'invoice.pdf');
-    const url = URL.createObjectURL(blob);
-    const a = document.createElement('a'); a.href = url; a.download = fname; document.body.appendChild(a); a.click();
-    setTimeout(()=>{ URL.revokeObjectURL(url); a.remove(); }, 500);
-    e.target.reset();
-    document.querySelector('#items tbody').innerHTML = '';
-    addRow();
-    refreshChallanOptions();
-  }catch(err){
-    console.error(err);
-  }finally{
-    hideLoader();
-    btn.disabled = false;
-  }
+BillingForms.submitAndDownload(document.getElementById('invoiceForm'), {
+  url: "{{ url_for('invoice') }}", button: document.getElementById('inv_submit'),
+  label: 'Saving invoice…', fallbackName: 'invoice.pdf',
+  onDone(){ itemsBody.replaceChildren(); addRow(); refreshChallanOptions(); },
 });
 </script>
 {% endblock %}
 """
 }
 
-# mount in-memory templates
+# mount in-memory templates; they're constant strings, so compile each once at import
 app.jinja_loader = DictLoader(TEMPLATES)
+app.jinja_env.globals["APP_CSS_HASH"] = APP_CSS_HASH
+app.jinja_env.globals["APP_JS_HASH"]  = APP_JS_HASH
+app.jinja_env.auto_reload = False
+app.jinja_env.cache_size = -1
+for _tname in TEMPLATES: app.jinja_env.get_template(_tname)
+
+_JSON_MEMO = {}   # name -> (object, its |tojson markup)
+
+def _tojson_cached(name, obj):
+    """Same output as |tojson, but serialised once per cached loader result."""
+    hit = _JSON_MEMO.get(name)
+    if hit is None or hit[0] is not obj:
+        hit = _JSON_MEMO[name] = (obj, htmlsafe_json_dumps(obj, dumps=app.json.dumps))
+    return hit[1]
+
+# gzip text responses (pages, API JSON, app.css/js); PDFs are already deflate streams, sent as files
+GZIP_LEVEL     = int(os.getenv("GZIP_LEVEL", "5"))   # 0 disables
+GZIP_MIN_BYTES = 512
+_GZIP_TYPES    = frozenset(("text/html", "text/css", "text/javascript", "application/json"))
+
+@app.after_request
+def _gzip_response(resp):
+    if (GZIP_LEVEL <= 0 or resp.mimetype not in _GZIP_TYPES or resp.direct_passthrough or resp.is_streamed
+            or "Content-Encoding" in resp.headers or not 200 <= resp.status_code < 300):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    data = resp.get_data()
+    if len(data) < GZIP_MIN_BYTES or request.accept_encodings["gzip"] <= 0:
+        return resp
+    resp.set_data(gzip.compress(data, GZIP_LEVEL, mtime=0))   # also resets Content-Length
+    resp.headers["Content-Encoding"] = "gzip"
+    return resp
 
 # ==============================
 # Routes
@@ -1360,6 +1833,20 @@ app.jinja_loader = DictLoader(TEMPLATES)
 def healthz():
     return "ok", 200
 
+def _immutable_asset(body, mimetype):
+    # URL carries the content hash, so the response never changes for a given URL
+    r = app.response_class(body, mimetype=mimetype)
+    r.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return r
+
+@app.route("/assets/app.css")
+def app_css():
+    return _immutable_asset(APP_CSS, "text/css")
+
+@app.route("/assets/app.js")
+def app_js():
+    return _immutable_asset(APP_JS, "text/javascript")
+
 @app.route("/", methods=["GET"])
 def root():
     return redirect(url_for("dashboard") if session.get("user") else url_for("login"))
@@ -1371,7 +1858,8 @@ def login():
         pwd  = request.form.get("password","").strip()
         remember = bool(request.form.get("remember"))
         if check_login_from_sheet(user, pwd):
-            session["user"] = user;  session.permanent = remember
+            session["user"] = user
+            session.permanent = remember
             return redirect(url_for("dashboard"))
         flash("Invalid ID or password.", "error")
     return render_template("login.html", PASS_TAB_NAME=PASS_TAB_NAME)
@@ -1380,6 +1868,12 @@ def login():
 def logout():
     session.clear();  return redirect(url_for("login"))
 
+@app.route("/admin/refresh", methods=["POST"])
+@login_required
+def admin_refresh():
+    _reset_clients(); invalidate_caches(); warm_caches()
+    return redirect(url_for("dashboard"))
+
 @app.route("/dashboard")
 @login_required
 def dashboard():
@@ -1388,27 +1882,50 @@ def dashboard():
                            firms=firms,
                            ID_TAB_NAME=ID_TAB_NAME)
 
+def _pdf_download_name(doc_no, name, now):
+    """<no>_<party/supplier>_<timestamp>.pdf, with the name reduced to [A-Za-z0-9_]."""
+    return f"{doc_no}_{_UNSAFE_NAME_RE.sub('_', name.strip().replace(' ', '_'))}_{now:%Y%m%d-%H%M%S}.pdf"
+
+def _pdf_response(buf, dl_name):
+    # each PDF is generated once for one download: keep it out of browser/proxy caches
+    resp = send_file(buf, as_attachment=True, download_name=_unique_name(dl_name),
+                     mimetype="application/pdf", conditional=False, etag=False)
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+def _parse_items(descs, qtys, rates, chnos=None):
+    """Form item lists -> [(challan no, desc, qty, rate, amount)], skipping blank/invalid rows."""
+    out = []; append = out.append; _float = float
+    for ch, d, q, r in zip(chnos if chnos is not None else repeat(""), descs, qtys, rates):
+        d = d.strip()
+        if not d or not q or not r: continue   # blank cells: skip without a float() raise
+        try: qf = _float(q); rf = _float(r)
+        except (TypeError, ValueError): continue
+        if qf <= 0 or rf < 0: continue
+        append((ch.strip(), d, qf, rf, qf*rf))
+    return out
+
 # ---------- Challan ----------
 @app.route("/challan", methods=["GET","POST"])
 @login_required
 def challan():
+    prefetch_sheets("firms", "suppliers")
     firms     = load_firms()
     suppliers = load_suppliers()
-    firm_keys = list(firms.keys())
     if request.method == "GET":
         return render_template("challan.html",
-                               firms=firms, suppliers=suppliers,
+                               firms=firms, suppliers=suppliers, suppliers_json=_tojson_cached("suppliers", suppliers),
                                next_no=get_next_challan_number(),
                                today=datetime.now(IST).strftime("%d/%m/%Y"),
                                CH_MAX_ROWS=CH_MAX_ROWS,
-                               firm_default=(firm_keys[0] if firm_keys else ""))
+                               firm_default=next(iter(firms), ""))
     # POST
     chosen_firm_key = request.form.get("firm_key")
     company = firms.get(chosen_firm_key, next(iter(firms.values()))) if firms else {
         "title_name":"", "company_name":"", "addr":"", "mobile":"", "gst":"", "bank_lines":[], "logo":""
     }
     party_code = request.form.get("party_code","")
-    party_src = load_suppliers().get(party_code, {"name":"", "gstin":"", "mobile":"", "address":""})
+    party_src = suppliers.get(party_code, {"name":"", "gstin":"", "mobile":"", "address":""})
     party = {
         "name":    request.form.get("party_name",  party_src.get("name","")),
         "gstin":   request.form.get("party_gstin", party_src.get("gstin","")),
@@ -1416,39 +1933,32 @@ def challan():
         "address": request.form.get("party_address",party_src.get("address","")),
     }
 
+    now    = datetime.now(IST)   # one clock read per request: default date, Created, file name
     ch_no  = request.form.get("challan_no") or "1"
-    ch_dt  = request.form.get("challan_date") or datetime.now(IST).strftime("%d/%m/%Y")
+    ch_dt  = request.form.get("challan_date") or now.strftime("%d/%m/%Y")
     supplier_challan_number = request.form.get("supplier_challan_number","").strip()
 
     descs = request.form.getlist("desc[]")
     qtys  = request.form.getlist("qty[]")
     rates = request.form.getlist("rate[]")
 
-    items = []
-    for d,q,r in zip(descs, qtys, rates):
-        if not d.strip(): continue
-        try:
-            qf = float(q); rf = float(r)
-            if qf <= 0 or rf < 0: continue
-        except: continue
-        items.append([d.strip(), qf, rf, qf*rf])
+    items = [[d, q, r, a] for _, d, q, r, a in _parse_items(descs, qtys, rates)]
 
     if not items:
-        flash("Add at least one valid item.", "error"); return redirect(url_for("challan"))
+        return jsonify(error="Add at least one valid item."), 400
 
-    buf = io.BytesIO()
-    draw_challan_pdf(
-        buf,
+    pdf_future = _PDF_POOL.submit(
+        _render_pdf, draw_challan_pdf,
         company=company,
         party=party,
         meta={"no": ch_no, "date": ch_dt, "supplier_challan_number": supplier_challan_number},
         items=items[:CH_MAX_ROWS]
     )
-    data = buf.getvalue()
 
-    created = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
+    created = now.strftime("%Y-%m-%d %H:%M:%S")
+    ch_rows = []
     for d, q, r, a in items:
-        row_dict = {
+        ch_rows.append({
             "Firm":                    company["company_name"],
             "Createed_Date":           created,
             "Invoice_Date":            ch_dt,
@@ -1462,33 +1972,42 @@ def challan():
             "Rate":                    f"{r:.2f}",
             "Amount":                  f"{r:.2f}",    # unit
             "Taxable_Amount":          f"{a:.2f}",    # total
-        }
-        append_row_to_challan(row_dict)
+        })
+    if not append_rows_to_challan(ch_rows):   # PDF render (in the pool) overlapped this write
+        return jsonify(error="Could not record the challan in Google Sheets; no PDF was issued. Please try again."), 502
+    _note_number_used("next_challan", ch_no)
 
-    timestamp = datetime.now(IST).strftime("%Y%m%d-%H%M%S")
-    safe_party = re.sub(r'[^A-Za-z0-9_]+', '_', (party['name'] or 'Party').strip().replace(' ', '_'))
-    dl_name = f"{ch_no}_{safe_party}_{timestamp}.pdf"
-    _save_copy("challan", company["company_name"], dl_name, data)
+    dl_name = _pdf_download_name(ch_no, party['name'] or 'Party', now)
+    buf = pdf_future.result()
+    _save_copy_async("challan", company["company_name"], dl_name, buf)
 
-    return send_file(io.BytesIO(data), as_attachment=True, download_name=_unique_name(dl_name), mimetype="application/pdf")
+    return _pdf_response(buf, dl_name)
+
+# ---------- Invoice: open challan rows for the import picker ----------
+@app.route("/api/challans")
+@login_required
+def api_challans():
+    firm, scode = request.args.get("firm", ""), request.args.get("supplier", "")
+    if not firm.strip() or not scode.strip(): return jsonify({})
+    return jsonify(load_challan_rows().open_rows(firm, scode))
 
 # ---------- Invoice ----------
 @app.route("/invoice", methods=["GET","POST"])
 @login_required
 def invoice():
+    # a GET page asks /api/challans right after loading; fetch that tab in the same batch
+    prefetch_sheets("firms", "suppliers", *(("challans",) if request.method == "GET" else ()))
     firms     = load_firms()
     suppliers = load_suppliers()
-    challans  = load_challan_rows()
-    firm_keys = list(firms.keys())
     if request.method == "GET":
         return render_template("invoice.html",
-                               firms=firms, suppliers=suppliers, challans=challans,
+                               firms=firms, suppliers=suppliers, suppliers_json=_tojson_cached("suppliers", suppliers),
                                next_no=get_next_invoice_number(),
                                today=datetime.now(IST).strftime("%d/%m/%Y"),
                                sac_default=SAC_DEFAULT,
                                gst_total=GST_TOTAL,
                                INV_MAX_ROWS=INV_MAX_ROWS,
-                               firm_default=(firm_keys[0] if firm_keys else ""))
+                               firm_default=next(iter(firms), ""))
     chosen_firm_key = request.form.get("firm_key")
     company = firms.get(chosen_firm_key, next(iter(firms.values()))) if firms else {
         "title_name":"", "company_name":"", "addr":"", "mobile":"", "gst":"", "bank_lines":[], "logo":""
@@ -1502,8 +2021,9 @@ def invoice():
         "address": request.form.get("supplier_address",sup_src.get("address","")),
     }
 
+    now    = datetime.now(IST)   # one clock read per request: default date, Created, file name
     inv_no = request.form.get("invoice_no") or "XXX"
-    inv_dt = request.form.get("invoice_date") or datetime.now(IST).strftime("%d/%m/%Y")
+    inv_dt = request.form.get("invoice_date") or now.strftime("%d/%m/%Y")
     discount = float(request.form.get("discount","0") or 0)
     sac_global = request.form.get("sac_global", SAC_DEFAULT).strip() or SAC_DEFAULT
 
@@ -1512,73 +2032,83 @@ def invoice():
     qtys  = request.form.getlist("qty[]")
     rates = request.form.getlist("rate[]")
 
-    items = []
-    for ch, d, q, r in zip(chnos, descs, qtys, rates):
-        if not d.strip(): continue
-        try:
-            qf=float(q); rf=float(r)
-            if qf <= 0 or rf < 0: continue
-        except: continue
-        a = qf*rf
-        items.append([ch.strip(), d.strip(), sac_global, qf, rf, a])
+    items, sub_total = [], 0.0
+    for ch, d, q, r, a in _parse_items(descs, qtys, rates, chnos):
+        items.append([ch, d, sac_global, q, r, a]); sub_total += a
 
     if not items:
-        flash("Add at least one valid item.", "error"); return redirect(url_for("invoice"))
+        return jsonify(error="Add at least one valid item."), 400
 
-    buf = io.BytesIO()
-    draw_invoice_pdf(buf, company, sup, {"no":inv_no, "date":inv_dt}, items[:INV_MAX_ROWS], discount)
-    data = buf.getvalue()
+    pdf_future = _PDF_POOL.submit(_render_pdf, draw_invoice_pdf,
+                                  company, sup, {"no":inv_no, "date":inv_dt}, items[:INV_MAX_ROWS], discount)
 
-    created = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
-    sub_total = sum(i[5] for i in items)
+    created = now.strftime("%Y-%m-%d %H:%M:%S")
+    cg, sg    = CGST_RATE/100.0, SGST_RATE/100.0
     gross_all = max(sub_total - discount, 0.0)
-    cgst_all  = gross_all * (CGST_RATE/100.0)
-    sgst_all  = gross_all * (SGST_RATE/100.0)
+    cgst_all  = gross_all * cg
+    sgst_all  = gross_all * sg
     rounded_total   = round(gross_all + cgst_all + sgst_all, 0)
     round_off_total = rounded_total - (gross_all + cgst_all + sgst_all)
 
+    # cells that are the same on every line of this invoice
+    head = [company["company_name"],          # Firm
+            created,                          # Createed_Date
+            inv_dt,                           # Invoice_Date
+            inv_no,                           # Invoice_Number
+            sup_code,                         # Supplier Code
+            sup["name"],                      # Supplier_Name
+            sup["gstin"]]                     # Gst_No
+    gst_pct = f"{GST_TOTAL:.0f}%"
+    last = len(items) - 1
+    inv_rows = []
     for i, (ch, d, sac, q, r, a) in enumerate(items):
         share = (a / sub_total) if sub_total > 0 else 0.0
         row_discount = discount * share
         row_taxable  = max(a - row_discount, 0.0)
-        row_cgst     = row_taxable * (CGST_RATE/100.0)
-        row_sgst     = row_taxable * (SGST_RATE/100.0)
-        row_round    = round_off_total if i == len(items)-1 else 0.0
+        row_cgst     = row_taxable * cg
+        row_sgst     = row_taxable * sg
+        row_round    = round_off_total if i == last else 0.0
         row_gross    = row_taxable + row_cgst + row_sgst + row_round
 
-        append_row_to_invoice([
-            company["company_name"],          # Firm
-            created,                          # Createed_Date
-            inv_dt,                           # Invoice_Date
-            inv_no,                           # Invoice_Number
-            sup_code,                         # Supplier Code
-            sup["name"],                      # Supplier_Name
-            sup["gstin"],                     # Gst_No
+        inv_rows.append([
+            *head,
             str(ch or ""),                    # Challan_Number
             d,                                # Description
             f"{q:.2f}",                       # Qty
             f"{a:.2f}",                       # Amount (line total)
             f"{row_taxable:.2f}",             # Taxable_Amount
             f"{row_discount:.2f}",            # Discount
-            f"{GST_TOTAL:.0f}%",              # Gst_Percentage
+            gst_pct,                          # Gst_Percentage
             f"{row_cgst:.2f}",                # CGST
             f"{row_sgst:.2f}",                # SGST
             f"{row_round:.2f}",               # Round_Off
             int(round(row_gross)),            # Grand_Total
         ])
+    if not append_rows_to_invoice(inv_rows):   # PDF render (in the pool) overlapped this write
+        return jsonify(error="Could not record the invoice in Google Sheets; no PDF was issued. Please try again."), 502
+    _note_number_used("next_invoice", inv_no)
+    # the invoice is recorded at this point: a failed write-back must not make the user re-submit it
+    mtr_ok = write_invoice_mtr_to_challan(company["company_name"], sup_code, items)
 
-    write_invoice_mtr_to_challan(company["company_name"], sup_code, items)
+    dl_name = _pdf_download_name(inv_no, sup['name'] or 'Supplier', now)
+    buf = pdf_future.result()
+    _save_copy_async("invoice", company["company_name"], dl_name, buf)
 
-    timestamp = datetime.now(IST).strftime("%Y%m%d-%H%M%S")
-    safe_sup = re.sub(r'[^A-Za-z0-9_]+', '_', (sup['name'] or 'Supplier').strip().replace(' ', '_'))
-    dl_name = f"{inv_no}_{safe_sup}_{timestamp}.pdf"
-    _save_copy("invoice", company["company_name"], dl_name, data)
-
-    return send_file(io.BytesIO(data), as_attachment=True, download_name=_unique_name(dl_name), mimetype="application/pdf")
+    resp = _pdf_response(buf, dl_name)
+    if not mtr_ok:
+        resp.headers["X-Sheet-Warning"] = "Invoice saved, but its challan rows could not be marked as invoiced."
+    return resp
 
 # ==============================
 # Main
 # ==============================
+# warm the Sheets caches off the import path so a fresh worker's first page isn't a cold miss
+if _SA_INFO and SPREADSHEET_ID and os.getenv("SHEETS_WARM_ON_START", "1") == "1":
+    threading.Thread(target=warm_caches, name="sheets-warm", daemon=True).start()
+
+# production (Procfile / railway.json): gunicorn app:app -k gthread --threads 8 --worker-tmp-dir /dev/shm
+# one worker by default, so there is a single copy of the in-process caches
 if __name__ == "__main__":
-  app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8080")), debug=True)
+  app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8080")),
+          debug=bool(int(os.getenv("FLASK_DEBUG", "0"))), use_reloader=False)
 